@@ -9,36 +9,99 @@
 # ***************************************************************************************
 # ***************************************************************************************
 
+import os
 from errors import *
 from textparser import *
 from streams import *
 from dictionary import *
 from democodegen import *
 from term import *
+from optimiser import *
+from tracker import *
+from calculator import *
+from strength import *
+from objectmodule import *
 
 # ***************************************************************************************
 #									Main assembler
 # ***************************************************************************************
 
 class Assembler(object):
-	def __init__(self,dictionary,codeGenerator):
+	def __init__(self,dictionary,codeGenerator,tokenCache = None):
 		self.dictionary = dictionary
+		self.tokenCache = tokenCache if tokenCache is not None else TokenCache()
+		self.optimise = codeGenerator.optimise
+		if self.optimise:												# optimising, put peephole in front
+			codeGenerator = PeepholeOptimiser(ValueTracker(codeGenerator))
 		self.codeGenerator = codeGenerator
+		self.strengthReducer = StrengthReducer(codeGenerator) if self.optimise else None
+		self.bootProcedures = []										# <name>.boot procedures in order
+		self.procedures = [] 											# [name,start,end] of procedure code
+		self.constantA = None 											# A's value if known at assembly time
+		self.includes = [] 												# files included, full paths
+		self.arrays = {} 												# address -> array identifier
 	#
 	#		New compilation
 	#
 	def assembleSource(self,parser):
 		self.parser = parser
 		self.termExtractor = TermExtractor(parser,self.codeGenerator,self.dictionary)
-		if self.assemble() != "":
-			raise AssemblerException("Syntax Error")
+		try:
+			if self.assemble() != "":
+				raise AssemblerException("Syntax Error")
+			self.loadConstant()
+		except AssemblerException as ex: 								# say where, if not known
+			ex.setLocation(*parser.getLocation())
+			raise ex
+		self.checkProcedures(True)										# module private ones must exist
+		if isinstance(self.codeGenerator,PeepholeOptimiser):			# anything buffered goes out.
+			self.codeGenerator.flush()
 		self.dictionary.purgeEndModule()
 	#
+	#		Complete a build, checking all called procedures have been defined.
+	#
+	def complete(self):
+		self.checkProcedures(False)
+	#
+	#		Create an object module to be linked from what has been assembled. This
+	#		needs a relocatable code generator. Procedures still undefined are in
+	#		other modules, so their calls and parameters become imports.
+	#
+	def createObject(self,name):
+		module = ObjectModule(name)
+		for ident in self.dictionary.getUndefinedProcedures():
+			code = self.codeGenerator.getExternal(ident.getName())
+			params = self.codeGenerator.getExternal(ident.getName()+ObjectModule.PARAMETERS)
+			for instrAddr,paramNumber in ident.getReferences():
+				self.codeGenerator.patchAddress(instrAddr,code if paramNumber is None else params+paramNumber*2)
+			module.calls[ident.getName()] = ident.getParameterCount()
+		module.code = self.codeGenerator.getCode()
+		module.data = self.codeGenerator.getData()
+		module.bss = self.codeGenerator.getBSSSize()
+		module.strings = self.codeGenerator.getStrings()
+		module.stringsRequested = self.codeGenerator.getStringPool().getRequested()
+		module.relocations = self.codeGenerator.getRelocations()
+		module.imports = self.codeGenerator.getImports()
+		module.exports = self.dictionary.getExports()
+		module.bootProcedures = self.getBootAddresses()
+		module.procedures = self.procedures
+		module.includes = self.includes
+		return module
+	#
+	#		Get the addresses of the boot procedures, in the order they were defined.
+	#
+	def getBootAddresses(self):
+		return [x.getValue() for x in self.bootProcedures]
+	#
+	def checkProcedures(self,privateOnly):
+		for ident in self.dictionary.getUndefinedProcedures():
+			if ident.getName()[0] == '_' or not privateOnly:
+				raise AssemblerException("Procedure "+ident.getName()+" is never defined")
+	#
 	#		assemble a full parser source.
 	#
 	def assemble(self):
 		while True:
-			print("==============================")
 			error = self.assembleInstruction()
 			if error is not None:
 				return error
@@ -66,6 +129,18 @@ class Assembler(object):
 			self.ifWhile(nextItem == "while")
 			return None
 		#
+		#		Constant definition
+		#
+		if nextItem == "const":
+			self.defineConstant()
+			return None
+		#
+		#		Include another source file
+		#
+		if nextItem == "include":
+			self.include()
+			return None
+		#
 		#		Procedure definition
 		#
 		if nextItem == "proc":											# proc definition.
@@ -75,19 +150,14 @@ class Assembler(object):
 		# 		Global/Local variable definitions
 		#
 		if nextItem == "global" or nextItem == "local":
-			varName = self.parser.get()
-			if not self.isIdentifier(varName):
-				raise AssemblerException("Bad variable name")
-			address = self.codeGenerator.allocate()
-			self.dictionary.add(VariableIdentifier(varName,address,nextItem == "global"))
+			self.defineVariable(nextItem == "global")
 			return None
 		#
-		#		Procedure definition
-		#
-
-		#
-		# 		Procedure call
+		# 		Procedure call, to an unknown identifier is a forward reference.
 		#
+		if ident is None and self.isIdentifier(nextItem) and self.parser.peek() == "(":
+			ident = ProcedureIdentifier(nextItem,None,None,None)
+			self.dictionary.add(ident)
 		if isinstance(ident,ProcedureIdentifier):
 			self.callProcedure(ident)
 			return None
@@ -98,7 +168,7 @@ class Assembler(object):
 			term = self.termExtractor.extract() 						# get the operand.
 			if term is None:
 				raise AssemblerException("Missing term")
-			self.codeGenerator.binaryOperation(nextItem,term)			# generate the code for it
+			self.binaryTerm(nextItem,term)								# generate the code for it
 			return None
 		#
 		# 		Assignment
@@ -112,27 +182,162 @@ class Assembler(object):
 		self.parser.put(nextItem) 										# put it back
 		term = self.termExtractor.extract() 							# try and grab a term.
 		if term is not None:											# found one ?
-			self.codeGenerator.loadARegister(term) 						# generate code to load a term in.
+			self.loadTerm(term) 										# generate code to load a term in.
 			return None 												# okay.
 		
 		return self.parser.get()
 	#
+	#		Define a variable, or an array <name>[<size>] whose size is a constant
+	#		expression in bytes, rounded up to whole words.
+	#
+	def defineVariable(self,isGlobal):
+		varName = self.parser.get()
+		if not self.isIdentifier(varName):
+			raise AssemblerException("Bad variable name")
+		if self.parser.peek() != "[":
+			self.dictionary.add(VariableIdentifier(varName,self.codeGenerator.allocate(),isGlobal))
+			return
+		self.parser.expect("[")
+		size = self.constantExpression()
+		if size == 0 or size > 0xFFFF:
+			raise AssemblerException("Bad array size")
+		self.parser.expect("]")
+		ident = ArrayIdentifier(varName,self.codeGenerator.allocate((size+1) // 2),size,isGlobal)
+		self.dictionary.add(ident)
+		self.arrays[ident.getValue()] = ident
+	#
+	#		Define a constant, const <name> = <expression>. The expression is worked out
+	#		now, left to right like code is, so uses no code or memory. Any operator
+	#		following a term continues the expression. The same constant may be defined
+	#		again with the same value, so headers can be included more than once.
+	#
+	def defineConstant(self):
+		name = self.parser.get()
+		if not self.isIdentifier(name):
+			raise AssemblerException("Bad constant name")
+		self.parser.expect("=")
+		value = self.constantExpression()
+		ident = self.dictionary.find(name)
+		if not isinstance(ident,ConstantIdentifier) or ident.getValue() != value:
+			self.dictionary.add(ConstantIdentifier(name,value))
+	#
+	#		Work out an expression whose value is known now.
+	#
+	def constantExpression(self):
+		value = self.constantTerm()
+		operator = self.parser.get()
+		while len(operator) == 1 and "+-*/%&|^".find(operator) >= 0:
+			value = Calculator.calculate(value,operator,self.constantTerm())
+			if value is None:
+				raise AssemblerException("Cannot calculate constant")
+			operator = self.parser.get()
+		self.parser.put(operator)
+		return value
+	#
+	#		Get a term whose value is known now, a number, string, @variable or constant.
+	#
+	def constantTerm(self):
+		element = self.parser.peek()
+		if self.isIdentifier(element) and not isinstance(self.dictionary.find(element),ConstantIdentifier):
+			raise AssemblerException("Constant expected, not "+element)
+		term = self.termExtractor.extract()
+		if term is None or term[0]:
+			raise AssemblerException("Constant expected")
+		return term[1]
+	#
+	#		Include a file, which is relative to the file including it.
+	#
+	def include(self):
+		fileName = self.parser.get()
+		if fileName[:1] != '"':
+			raise AssemblerException("Missing file name for include")
+		fileName = os.path.join(os.path.dirname(self.parser.getLocation()[0]),fileName[1:-1])
+		tokens = self.tokenCache.getTokens(fileName)
+		if os.path.abspath(fileName) not in self.includes:
+			self.includes.append(os.path.abspath(fileName))
+		self.parser.include(tokens)
+	#
+	#		Load a term into A. Constants are not loaded until they are needed, so
+	#		constant expressions can be worked out here rather than at run time.
+	#
+	def loadTerm(self,term):
+		if term[0]:
+			self.constantA = None
+			self.codeGenerator.loadARegister(term)
+		else:
+			self.constantA = term[1]
+	#
+	#		Binary operation on A, which is done now if A and the term are constant.
+	#
+	def binaryTerm(self,operator,term):
+		if self.constantA is not None and not term[0]:
+			if (operator == "!" or operator == "?") and term[1] <= 0xFFFF:	# read from a known address
+				self.loadIndirect(operator == "!",self.getIndexed(self.constantA,term[1],operator == "!"))
+				return
+			result = Calculator.calculate(self.constantA,operator,term[1])
+			if result is not None:
+				self.constantA = result
+				return
+		self.loadConstant()
+		if self.strengthReducer is not None and not term[0] and term[1] <= 0xFFFF:	# * / % constant ?
+			if self.strengthReducer.reduce(operator,term[1]):
+				return
+		self.codeGenerator.binaryOperation(operator,term)
+	#
+	#		Read the word or byte at an address known now.
+	#
+	def loadIndirect(self,isWord,address):
+		self.constantA = None
+		if isWord:
+			self.codeGenerator.loadARegister([True,address])
+		else:
+			self.codeGenerator.loadARegister([False,address])
+			self.codeGenerator.binaryOperation("?",[False,0])
+	#
+	#		Get the address of base!index or base?index, which must be inside the
+	#		array if base is one. A relocatable address keeps its segment tag.
+	#
+	def getIndexed(self,base,index,isWord):
+		if base in self.arrays and index + (2 if isWord else 1) > self.arrays[base].getSize():
+			raise AssemblerException("Index out of range for "+self.arrays[base].getName())
+		return ((base >> 16) << 16) | ((base + index) & 0xFFFF)
+	#
+	#		Anything other than a load or binary operation needs A to actually have
+	#		any pending constant in it.
+	#
+	def loadConstant(self):
+		if self.constantA is not None:
+			self.codeGenerator.loadARegister([False,self.constantA])
+			self.constantA = None
+	#
 	#		Do a binary assignment (>)
 	#
 	def binaryAssignment(self):
 		term = self.termExtractor.extract() 							# where to save.
-		if not term[0]:
+		if term is None:
 			raise AssemblerException("Must assign to an address")
+		self.loadConstant()
 		nextItem = self.parser.get() 									# see if followed by ! or ?
 		if nextItem == "?" or nextItem == "!":							# if so, it's an indirect save.
 			rTerm = self.termExtractor.extract()						# get following term
 			if rTerm is None:
 				raise AssemblerException("Bad assignment")
-			self.codeGenerator.copyToTemp() 							# save result
-			self.codeGenerator.loadARegister(term) 						# calculate the address
-			self.codeGenerator.binaryOperation("+",rTerm)
+			if not term[0] and not rTerm[0] and rTerm[1] <= 0xFFFF:		# address known now
+				address = self.getIndexed(term[1],rTerm[1],nextItem == "!")
+				if nextItem == "!":										# word is a direct save
+					self.codeGenerator.saveDirect(address)
+					return
+				self.codeGenerator.copyToTemp()
+				self.loadTerm([False,address])
+			else:
+				self.codeGenerator.copyToTemp() 						# save result
+				self.loadTerm(term) 									# calculate the address
+				self.binaryTerm("+",rTerm)
+			self.loadConstant()
 			self.codeGenerator.saveTempIndirect(nextItem == "!") 		# and write there.
 		else:
+			if not term[0]:
+				raise AssemblerException("Must assign to an address")
 			self.codeGenerator.saveDirect(term[1]) 						# store to memory
 			self.parser.put(nextItem) 									# put last element back
 	#
@@ -140,19 +345,31 @@ class Assembler(object):
 	#
 	def callProcedure(self,procIdent):
 		self.parser.expect("(")											# check open bracket.
-		paramCount = procIdent.getParameterCount()						# how many parameters ?
-		paramAddress = procIdent.getParameterBaseAddress()				# where do they go ?
-		while paramCount > 0:
+		paramCount = 0 													# parameters compiled
+		endChar = self.parser.get() if self.parser.peek() == ")" else ","
+		while endChar == ",":
 			endChar = self.assemble() 	
-			if endChar != (")" if paramCount == 1 else ","):			# should finish with , or )
+			if endChar != "," and endChar != ")":						# should finish with , or )
 				raise AssemblerException("Badly formed parameters")
-			self.codeGenerator.saveDirect(paramAddress) 				# save whatever it was.
-			paramCount -= 1 											# one fewer parameter.
-			paramAddress += 2 
-			if paramCount == 0:											# put ) back on last
-				self.parser.put(")")
-		self.parser.expect(")")
-		self.codeGenerator.callProcedure(procIdent.getValue())			# compile procedure call.
+			self.loadConstant()
+			if procIdent.isDefined() and procIdent.hasRegisterParameter() and endChar == ")":
+				self.codeGenerator.copyToTemp(True) 					# last one goes in a register
+			elif procIdent.isDefined():									# save whatever it was.
+				self.codeGenerator.saveDirect(procIdent.getParameterBaseAddress()+paramCount*2)
+			else: 														# or patch it when defined
+				procIdent.addReference(self.codeGenerator.saveDirect(None),paramCount)
+				if endChar == ")":										# it may want the last in a register,
+					self.codeGenerator.copyToTemp(True) 				# even if this is not optimised
+			paramCount += 1 											# one more parameter.
+		if procIdent.getParameterCount() is None:						# first forward reference
+			procIdent.paramCount = paramCount
+		if paramCount != procIdent.getParameterCount():
+			raise AssemblerException("Badly formed parameters")
+		self.loadConstant() 											# A is in use, even with no parameters
+		if procIdent.isDefined():										# compile procedure call.
+			self.codeGenerator.callProcedure(procIdent.getValue())
+		else:
+			procIdent.addReference(self.codeGenerator.callProcedure(None),None)
 	#
 	#		Handle a for loop
 	#
@@ -162,13 +379,59 @@ class Assembler(object):
 		if endChar != ")":
 			raise AssemblerException("Missing ) in for")
 		ixVar = self.dictionary.find("index")							# Look for a variable called index
+		useIndex = self.checkCounterLoop()
+		if useIndex is not None:										# count in a register
+			self.counterLoop(ixVar,useIndex)
+			return
+		self.loadConstant()
 		loop = self.codeGenerator.forTopCode(ixVar) 					# top of loop
 		self.assembleInstruction() 										# body of loop
+		self.loadConstant()
 		self.codeGenerator.forBottomCode(loop) 							# bottom of loop
 	#
+	#		When optimising, a for loop whose body is a { } group with no calls, loops,
+	#		procedures or includes in it can keep its count in a register. Returns None
+	#		if it cannot, otherwise whether the body needs A to be the index at the top,
+	#		because it uses index or does something to A before loading it.
+	#
+	def checkCounterLoop(self):
+		if not self.optimise:
+			return None
+		body = self.parser.peekGroup()
+		if body is None:
+			return None
+		for n in range(0,len(body)):
+			if body[n] in Assembler.NOCOUNTER:
+				return None
+			if body[n] not in Assembler.STRUCTURES and self.isIdentifier(body[n]) and n+1 < len(body) and body[n+1] == "(":
+				return None 											# procedure call
+		first = [x for x in body if x != "{" and x != "(" and x not in Assembler.STRUCTURES][0]
+		loadsA = first[0] == '"' or first[0] == '@' or (first[0] >= '0' and first[0] <= '9')
+		loadsA = loadsA or (self.isIdentifier(first) and first not in Assembler.DECLARATIONS)
+		return "index" in body or not loadsA
+	#
+	#		Compile a for loop counting in a register. A constant count does not need to
+	#		be loaded. Afterwards A is zero, and so is index as if it had been counted.
+	#
+	def counterLoop(self,ixVar,useIndex):
+		count = self.constantA
+		if count is None or count > 0xFFFF:								# count is worked out in A
+			self.loadConstant()
+			count = None
+		self.constantA = None
+		loop = self.codeGenerator.counterTopCode(ixVar if useIndex else None,count,useIndex)
+		self.assembleInstruction() 										# body of loop
+		self.loadConstant()
+		self.codeGenerator.counterBottomCode(loop)
+		self.constantA = 0
+		if ixVar is not None and not useIndex:
+			self.loadConstant()
+			self.codeGenerator.saveDirect(ixVar.getValue())
+	#
 	#		Handle if and while. Same code, but while has a jump back to the test at the bottom :)	
 	#
 	def ifWhile(self,isWhile):
+		self.loadConstant()
 		whileJump = self.codeGenerator.getAddress()						# remember loop for while.
 		self.parser.expect("(")											# ( opening the test
 		endChar = self.assemble()										# expression to # < = closing it.
@@ -181,8 +444,10 @@ class Assembler(object):
 			if n < 0:
 				raise AssemblerException("Bad condition")
 			endChar = "#+="[n]											# reverse it so this is fail test.
+		self.loadConstant()
 		testAddress = self.codeGenerator.compileJump(endChar) 			# compile Jump out if fail.
 		self.assembleInstruction() 										# body of code to repeat or skip
+		self.loadConstant()
 		if isWhile:
 			loopBackJump = self.codeGenerator.compileJump("")
 			self.codeGenerator.patchJump(loopBackJump,whileJump)
@@ -199,6 +464,7 @@ class Assembler(object):
 	#		Define a procedure
 	#
 	def defineProcedure(self):
+		self.loadConstant()
 		procName = self.parser.get()									# Get and check name
 		if not self.isIdentifier(procName):
 			raise AssemblerException("Bad procedure name")
@@ -214,15 +480,64 @@ class Assembler(object):
 				nextElement = self.parser.get()
 
 		baseAddr = self.codeGenerator.allocate(len(paramList))			# memory for parameters
-																		# define and add procedure
-		ident = ProcedureIdentifier(procName,self.codeGenerator.getAddress(),baseAddr,len(paramList))
-		self.dictionary.add(ident)
+		inRegister = self.checkRegisterParameter(paramList)
+		ident = self.dictionary.find(procName) 							# already called ?
+		if isinstance(ident,ProcedureIdentifier) and not ident.isDefined():
+			self.resolveProcedure(ident,baseAddr,len(paramList),inRegister)
+		else:															# define and add procedure
+			ident = ProcedureIdentifier(procName,self.codeGenerator.getAddress(),baseAddr,len(paramList),inRegister)
+			self.dictionary.add(ident)
+		if procName.endswith(".boot"):									# run at start up.
+			self.bootProcedures.append(ident)
 		for i in range(0,len(paramList)):								# add parameters as locals
 			ident = VariableIdentifier(paramList[i],i*2+baseAddr,False)
 			self.dictionary.add(ident)
+		if inRegister:													# last parameter is the temp register
+			self.codeGenerator.setTempVariable(baseAddr+len(paramList)*2-2)
+		start = self.codeGenerator.getAddress()
 		self.assembleInstruction()										# assemble body
+		self.loadConstant()
 		self.codeGenerator.returnProcedure()							# return code.
+		if inRegister:
+			self.codeGenerator.setTempVariable(None)
+		self.procedures.append([procName,start,self.codeGenerator.getAddress()])
 		self.dictionary.purgeLocals()									# throw the locals.
+	#
+	#		Define a procedure which has been forward referenced, patching the calls to it.
+	#
+	def resolveProcedure(self,ident,baseAddr,paramCount,inRegister):
+		if ident.getParameterCount() != paramCount:
+			raise AssemblerException("Procedure "+ident.getName()+" called with wrong parameters")
+		address = self.codeGenerator.getAddress()
+		for instrAddr,paramNumber in ident.getReferences():				# fix up calls and parameters
+			self.codeGenerator.patchAddress(instrAddr,address if paramNumber is None else baseAddr+paramNumber*2)
+		ident.define(address,baseAddr,paramCount,inRegister)
+	#
+	#		When optimising, a procedure whose body is a { } group which calls nothing
+	#		can keep its last parameter in the temp register, if nothing in it uses
+	#		that. That is an indirect save, a multiply which may be done with adds, or
+	#		the parameter's address.
+	#
+	def checkRegisterParameter(self,paramList):
+		if not self.optimise or len(paramList) == 0:
+			return False
+		body = self.parser.peekGroup()
+		if body is None:
+			return False
+		for n in range(0,len(body)):
+			if body[n] == "proc" or body[n] == "include" or body[n] == "*":
+				return False
+			if body[n] not in Assembler.STRUCTURES and self.isIdentifier(body[n]) and n+1 < len(body) and body[n+1] == "(":
+				return False 											# procedure call
+			if (body[n] == "!" or body[n] == "?") and ">" in body[max(0,n-3):n]:
+				return False 											# may be an indirect save
+			if body[n] == "@" and n+1 < len(body) and body[n+1] == paramList[-1]:
+				return False
+		return True
+
+Assembler.NOCOUNTER = [ "for","proc","include" ]						# stop a loop counting in a register
+Assembler.STRUCTURES = [ "if","while" ] 								# followed by ( but not calls
+Assembler.DECLARATIONS = [ "const","local","global" ]					# compile no code
 
 if __name__ == "__main__":
 	tas = TextArrayStream("""
@@ -241,9 +556,14 @@ if __name__ == "__main__":
 		proc test(c1,c2) { 2>c1 3>c2 }
 
 		test(_module,42)
+		later(1,n2) later(2,3)
+		proc later(a,b) { a+b }
+		const size = 4*8+2 const mask = size-1 
+		size+n2>n2 mask&n2
 	""".split("\n"))
 
 	p = TextParser(tas)
 	cm = Assembler(TestDictionary(),DemoCodeGenerator())
 	cm.assembleSource(p)
+	cm.complete()
 	print(cm.dictionary.toString())
\ No newline at end of file
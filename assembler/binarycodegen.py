@@ -0,0 +1,307 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		binarycodegen.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		20th December 2018
+#		Purpose :	Imaginary CPU code generator, generating binary code.
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+from codebuffer import *
+from stringpool import *
+
+# ***************************************************************************************
+#
+#		Code generator for the imaginary CPU of DemoCodeGenerator, but writing opcodes
+#		into a code buffer and variables/strings into a seperate data buffer. The
+#		listing is produced by disassembling the buffers, and only when asked for.
+#
+#		Opcodes are one byte followed by a 16 bit operand (data) or a 24 bit operand
+#		(call or jump), both low byte first.
+#
+# ***************************************************************************************
+
+class BinaryCodeGenerator(object):
+	def __init__(self,optimise = False,codeBase = 0x1000,dataBase = 0x3000):
+		self.optimise = optimise
+		self.code = CodeBuffer(codeBase)								# code space
+		self.data = CodeBuffer(dataBase)								# variables and strings
+		self.strings = [] 												# string addresses, for listing.
+		self.stringPool = StringPool() 									# so each is only placed once
+		self.tempVariable = None 										# variable kept in b, if any
+		self.fixups = {}												# unresolved operands, address -> size
+		self.opCodes = {}												# binary operator -> opcode
+		for i in range(0,len(BinaryCodeGenerator.OPERATORS)):
+			self.opCodes[BinaryCodeGenerator.OPERATORS[i]] = 0x10+i*2
+		self.jumpTypes = { "":0x30,"#":0x31,"=":0x32,"+":0x33,"-":0x34 }
+	#
+	#		Addresses are absolute, not relocated by a linker.
+	#
+	def isRelocatable(self):
+		return False
+	#
+	#		Get current address in code space.
+	#
+	def getAddress(self):
+		return self.code.getAddress()
+	#
+	#		Allocate memory for a variable.
+	#
+	def allocate(self,count = 1):
+		return self.data.reserve(count * 2)
+	#
+	#		Place an ASCIIZ string constant in the data area, once, return its address
+	#
+	def stringConstant(self,str):
+		address = self.stringPool.find(str)
+		if address is None:
+			address = self.data.getAddress()
+			self.data.append(str.encode("latin-1")+b"\x00")
+			self.strings.append(address)
+			self.stringPool.add(str,address)
+		return address
+	#
+	#		Load Accumulator with constant or term.
+	#
+	def loadARegister(self,term):
+		if term[0] and term[1] == self.tempVariable:
+			self.code.append([0x2D])									# mov a,b
+			return
+		self.emit(0x02 if term[0] else 0x01,term[1])
+	#
+	#		Perform a binary operation with a constant/term on the accumulator.
+	#
+	def binaryOperation(self,operator,term):
+		if operator == "!" or operator == "?":							# indirect, we do add then read
+			if term[0] or term[1] != 0 or not self.optimise:			# no add needed for +0
+				self.binaryOperation("+",term)
+			self.code.append([0x20 if operator == "!" else 0x21])
+			return
+		if term[0] and term[1] == self.tempVariable:
+			self.code.append([self.opCodes[operator]+0x30])				# op a,b
+			return
+		self.emit(self.opCodes[operator]+(1 if term[0] else 0),term[1])
+	#
+	#		Save A at the address given
+	#
+	def saveDirect(self,address):
+		if address is not None and address == self.tempVariable:
+			self.code.append([0x29])									# mov b,a
+			return None
+		instrAddr = self.getAddress()
+		if address is None:												# not known yet, patch later
+			self.fixups[instrAddr] = 2
+			address = 0
+		self.emit(0x22,address)
+		return instrAddr
+	#
+	#		Keep the variable at an address in the temp register rather than memory,
+	#		or stop if None.
+	#
+	def setTempVariable(self,address):
+		self.tempVariable = address
+	#
+	#		Save temp register indirect through A, byte or word, and put temp back in A
+	#		unless it is not going to be used.
+	#
+	def saveTempIndirect(self,isWord,restoreA = True):
+		self.code.append([0x23 if isWord else 0x24])
+		if restoreA:
+			self.code.append([0x25])
+	#
+	#		Copy A to the temp register, A value unknown after this unless kept.
+	#
+	def copyToTemp(self,keepA = False):
+		self.code.append([0x29 if keepA else 0x26])
+	#
+	#		Add the temp register to A
+	#
+	def addTemp(self):
+		self.code.append([0x2A])
+	#
+	#		Logical shift A left or right
+	#
+	def shiftOperation(self,isLeft,count):
+		self.code.append([0x2B if isLeft else 0x2C,count])
+	#
+	#		Compile a call to a procedure (call should protect 'A')
+	#
+	def callProcedure(self,address):
+		instrAddr = self.getAddress()
+		if address is None:												# forward reference, patch later
+			self.fixups[instrAddr] = 3
+			address = 0
+		self.emitLong(0x27,address)
+		return instrAddr
+	#
+	#		Return from procedure (should protect A)
+	#
+	def returnProcedure(self):
+		self.code.append([0x28])
+	#
+	#		Compile a jump with the given condition ( "", "=", "#", "+" "-""). The
+	#		target address is not known yet.
+	#
+	def compileJump(self,condition):
+		assert condition in self.jumpTypes
+		jumpAddr = self.getAddress()
+		self.emitLong(self.jumpTypes[condition],0)
+		self.fixups[jumpAddr] = 3
+		return jumpAddr
+	#
+	#		Patch a jump given its base addres
+	#
+	def patchJump(self,jumpAddr,target):
+		self.resolveFixup(jumpAddr,target)
+	#
+	#		Patch the address in a call or save compiled without one.
+	#
+	def patchAddress(self,instrAddr,address):
+		self.resolveFixup(instrAddr,address)
+	#
+	#		Write the operand of an instruction in the fixup table, and remove it
+	#
+	def resolveFixup(self,instrAddr,value):
+		size = self.fixups.pop(instrAddr)
+		self.code.writeWord(instrAddr+1,value)
+		if size == 3:
+			self.code.writeByte(instrAddr+3,value >> 16)
+	#
+	#		Get the addresses of instructions still waiting for an operand
+	#
+	def getUnresolved(self):
+		return sorted(self.fixups.keys())
+	#
+	#		Compile the top of a for loop.
+	#
+	def forTopCode(self,indexVar):
+		loop = self.getAddress()
+		self.code.append([0x38,0x39])									# decrement count, push on stack
+		if indexVar is not None:										# if index exists put it there
+			self.saveDirect(indexVar.getValue())
+		return loop
+	#
+	#		Compile the bottom of a for loop
+	#
+	def forBottomCode(self,loopAddress):
+		self.code.append([0x3A])										# pop off stack, jump if not done
+		self.emitLong(self.jumpTypes["#"],loopAddress)
+	#
+	#		Compile the top of a for loop counting in the c register. count is the
+	#		constant count or None if it is in A. A is only set to the index if setA.
+	#
+	def counterTopCode(self,indexVar,count,setA):
+		if count is None:
+			self.code.append([0x3B])									# mov c,a
+		else:
+			self.emit(0x3C,count)										# ldr c,#count
+		loop = self.getAddress()
+		self.code.append([0x3D])										# dec c
+		if setA:
+			self.code.append([0x3E])									# mov a,c
+			if indexVar is not None:
+				self.saveDirect(indexVar.getValue())
+		return loop
+	#
+	#		Compile the bottom of a for loop counting in the c register.
+	#
+	def counterBottomCode(self,loopAddress):
+		self.emitLong(0x35,loopAddress)									# jcnz loop
+	#
+	#		Emit opcode with 16 and 24 bit operands
+	#
+	def emit(self,opcode,operand):
+		self.code.append([opcode,operand & 0xFF,(operand >> 8) & 0xFF])
+	def emitLong(self,opcode,operand):
+		self.code.append([opcode,operand & 0xFF,(operand >> 8) & 0xFF,(operand >> 16) & 0xFF])
+	#
+	#		Get the code and data as bytes
+	#
+	def getCode(self):
+		return self.code.getBytes()
+	def getData(self):
+		return self.data.getBytes()
+	#
+	#		Create a listing of code and data. This is only done when asked for.
+	#
+	def getListing(self):
+		listing = []
+		address = self.code.baseAddress
+		while address < self.code.getAddress():							# disassemble the code
+			opcode = self.code.readByte(address)
+			mnemonic,size = BinaryCodeGenerator.DISASSEMBLY[opcode]
+			if size == 1:
+				mnemonic = mnemonic.format(self.code.readByte(address+1))
+			if size == 2:
+				mnemonic = mnemonic.format(self.code.readWord(address+1))
+			if size == 3:
+				mnemonic = mnemonic.format(self.code.readWord(address+1)+(self.code.readByte(address+3) << 16))
+			listing.append("${0:06x} : {1}".format(address,mnemonic))
+			address += size+1
+		strings = self.strings + [self.data.getAddress()]				# list the data area
+		address = self.data.baseAddress
+		while address < self.data.getAddress():
+			if address == strings[0]:									# a string
+				end = address
+				while self.data.readByte(end) != 0:
+					end += 1
+				text = self.data.buffer[address-self.data.baseAddress:end-self.data.baseAddress]
+				listing.append("${0:06x} : db    '{1}',0".format(address,text.decode("latin-1")))
+				address = end + 1
+				strings = strings[1:]
+			else:														# variables upto next string
+				listing.append("${0:06x} : ds    {1}".format(address,strings[0]-address))
+				address = strings[0]
+		return "\n".join(listing)
+
+BinaryCodeGenerator.OPERATORS = "+-*/%&|^"
+
+# ***************************************************************************************
+#					Disassembly table, opcode -> (mnemonic,operand size)
+# ***************************************************************************************
+
+BinaryCodeGenerator.DISASSEMBLY = {
+	0x01:("ldr   a,#${0:04x}",2), 	0x02:("ldr   a,(${0:04x})",2),
+	0x20:("ldr.w a,[a]",0),		 	0x21:("ldr.b a,[a]",0),
+	0x22:("str   a,(${0:04x})",2),
+	0x23:("str.w b,[a]",0),	  		0x24:("str.b b,[a]",0),
+	0x25:("tba",0), 				0x26:("tab",0),
+	0x29:("mov   b,a",0),			0x2A:("add   a,b",0),			0x2D:("mov   a,b",0),
+	0x2B:("shl   a,#{0}",1),		0x2C:("shr   a,#{0}",1),
+	0x27:("call  ${0:06x}",3),		0x28:("ret",0),
+	0x30:("jmp   ${0:06x}",3),		0x31:("jnz   ${0:06x}",3),		0x32:("jz    ${0:06x}",3),
+	0x33:("jpe   ${0:06x}",3),		0x34:("jmi   ${0:06x}",3),
+	0x35:("jcnz  ${0:06x}",3),
+	0x38:("dec   a",0),				0x39:("push  a",0),				0x3A:("pop   a",0),
+	0x3B:("mov   c,a",0),			0x3C:("ldr   c,#${0:04x}",2),	0x3D:("dec   c",0),
+	0x3E:("mov   a,c",0)
+}
+for i in range(0,len(BinaryCodeGenerator.OPERATORS)):
+	name = ["add","sub","mult","div","mod","and","or","xor"][i]
+	BinaryCodeGenerator.DISASSEMBLY[0x10+i*2] = ("{0:4}  a,#${{0:04x}}".format(name),2)
+	BinaryCodeGenerator.DISASSEMBLY[0x11+i*2] = ("{0:4}  a,(${{0:04x}})".format(name),2)
+	BinaryCodeGenerator.DISASSEMBLY[0x40+i*2] = ("{0:4}  a,b".format(name),0)
+
+if __name__ == "__main__":
+	from textparser import *
+	from assembler import *
+	tas = TextArrayStream("""
+		locvar+5->locvar
+		42+locvar>glbvar?2
+		locvar!glbvar+locvar?2
+		hello(locvar,glbvar?13,42)>locvar
+		local n1 global n2
+		"hello" "world" >n2
+		for (42) { n1+1>n1 }
+		while (n1<0) { 1>n1 }
+		proc test(c1,c2) { 2>c1 3>c2 }
+		test(n2,42)
+		later(1,n2) later(2,3)
+		proc later(a,b) { a+b }
+	""".split("\n"))
+	cg = BinaryCodeGenerator()
+	Assembler(TestDictionary(),cg).assembleSource(TextParser(tas))
+	print(cg.getListing())
+	print(len(cg.getCode()),len(cg.getData()),cg.getUnresolved())
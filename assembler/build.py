@@ -0,0 +1,158 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		build.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		23rd December 2018
+#		Purpose :	Build a project of modules into a boot.img
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+import os,sys
+from concurrent.futures import ProcessPoolExecutor
+from errors import *
+from assembler import *
+from z80codegen import *
+from linker import *
+from objectcache import *
+from imagewriter import *
+
+# ***************************************************************************************
+#
+#		Assemble one module into an object module. This runs in a worker process
+#		so must be a top level function, and everything it returns is pickled. The
+#		source is read and tokenised as it is assembled, not loaded as a whole.
+#		Included files are tokenised once in each process and the tokens reused.
+#
+# ***************************************************************************************
+
+tokenCache = TokenCache()
+
+def assembleModule(fileName,optimise):
+	assembler = Assembler(Dictionary(),Z80CodeGenerator(optimise,relocatable = True),tokenCache)
+	assembler.assembleSource(TextParser(FileStream(fileName)))
+	return assembler.createObject(fileName)
+
+# ***************************************************************************************
+#
+#		Modules only depend on each other through their globals, which are
+#		resolved when linking, so they are all assembled at the same time. Those
+#		which have not changed since the last build come from the cache.
+#
+# ***************************************************************************************
+
+class Builder(object):
+	def __init__(self,optimise = False,workers = None,cache = None):
+		self.optimise = optimise
+		self.workers = workers 											# None is one per processor
+		self.cache = cache 												# ObjectCache or None
+		self.linker = Linker()
+		self.assembled = [] 											# modules not from the cache
+	#
+	#		Build the modules, in the order given, into a paged image and return it.
+	#
+	def build(self,fileNames,image = None):
+		return self.linker.link(self.assemble(fileNames),image)
+	#
+	#		Get the object modules. Object files are read, source files come from the
+	#		cache or are assembled.
+	#
+	def assemble(self,fileNames):
+		modules = [None] * len(fileNames)
+		keys = [None] * len(fileNames)
+		for n in range(0,len(fileNames)):
+			if not os.path.isfile(fileNames[n]):
+				raise AssemblerException("File not found",fileNames[n],0)
+			if fileNames[n].endswith(".obj"):
+				modules[n] = ObjectModule.read(fileNames[n])
+			elif self.cache is not None:
+				keys[n] = self.cache.getKey(fileNames[n],self.optimise)
+				modules[n] = self.cache.load(fileNames[n],keys[n])
+		self.assembled = [n for n in range(0,len(fileNames)) if modules[n] is None]
+		names = [fileNames[n] for n in self.assembled]
+		if self.workers == 1 or len(names) < 2:							# not worth starting processes
+			objects = [assembleModule(x,self.optimise) for x in names]
+		else:
+			with ProcessPoolExecutor(self.workers) as pool:
+				objects = list(pool.map(assembleModule,names,[self.optimise] * len(names)))
+		for n in range(0,len(self.assembled)):
+			modules[self.assembled[n]] = objects[n]
+			if self.cache is not None:
+				self.cache.save(names[n],keys[self.assembled[n]],objects[n])
+		return modules
+	#
+	#		Read a project file, which lists the modules one per line.
+	#
+	@staticmethod
+	def readProject(projectFile):
+		if not os.path.isfile(projectFile):
+			raise AssemblerException("File not found",projectFile,0)
+		h = open(projectFile,"r")
+		lines = [x if x.find("//") < 0 else x[:x.find("//")] for x in h.readlines()]
+		h.close()
+		directory = os.path.dirname(projectFile)
+		return [os.path.join(directory,x.strip()) for x in lines if x.strip() != ""]
+
+# ***************************************************************************************
+#
+#		-s assembles each module to a .obj file and does not link. Object files can be
+#		given instead of modules.
+#
+#		build.py [-o boot.img] [-O] [-j workers] [-c cachedir] [-n] [-s] [-m] <module, .obj or .prj> ...
+#
+# ***************************************************************************************
+
+if __name__ == "__main__":
+	outputFile = "boot.img"
+	optimise = False
+	workers = None
+	showMap = False
+	separate = False
+	cacheDirectory = ".hlacache"
+	fileNames = []
+	args = sys.argv[1:]
+	while len(args) > 0:
+		arg = args.pop(0)
+		if arg == "-o":
+			outputFile = args.pop(0)
+		elif arg == "-O":
+			optimise = True
+		elif arg == "-j":
+			workers = int(args.pop(0))
+		elif arg == "-c":
+			cacheDirectory = args.pop(0)
+		elif arg == "-n":
+			cacheDirectory = None
+		elif arg == "-s":
+			separate = True
+		elif arg == "-m":
+			showMap = True
+		elif arg.endswith(".prj"):
+			fileNames += Builder.readProject(arg)
+		else:
+			fileNames.append(arg)
+	if len(fileNames) == 0:
+		print("build.py [-o boot.img] [-O] [-j workers] [-c cachedir] [-n] [-s] [-m] <module, .obj or .prj> ...")
+		sys.exit(1)
+	builder = Builder(optimise,workers,None if cacheDirectory is None else ObjectCache(cacheDirectory))
+	try:
+		if separate:
+			modules = builder.assemble(fileNames)
+		else:
+			linked = builder.build(fileNames) 							# in memory until it has linked
+			image = ImageWriter(outputFile)
+			image.copy(linked)
+	except AssemblerException as ex:
+		print("Error : "+ex.get())
+		sys.exit(1)
+	if separate:
+		for n in range(0,len(fileNames)):
+			if not fileNames[n].endswith(".obj"):
+				modules[n].write(os.path.splitext(fileNames[n])[0]+".obj")
+	elif showMap:
+		print(builder.linker.toString(),end = "")
+		print("{0} of {1} pages changed".format(len(image.getChanged()),1+PagedImage.PAGECOUNT))
+		print("strings : "+builder.linker.stringPool.toString())
+	if showMap:
+		print("{0} of {1} modules assembled".format(len(builder.assembled),len(fileNames)))
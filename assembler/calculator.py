@@ -0,0 +1,45 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		calculator.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		22nd December 2018
+#		Purpose :	Assembly time arithmetic
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+# ***************************************************************************************
+#		Works out constant <operator> constant as the code would, 16 bit unsigned.
+#		Values above $FFFF are relocatable addresses, tagged with their segment.
+# ***************************************************************************************
+
+class Calculator(object):
+	#
+	#		Calculate result, returns None if it can't be done at assembly time.
+	#
+	@staticmethod
+	def calculate(left,operator,right):
+		if left > 0xFFFF or right > 0xFFFF:								# relocatable, not known till link
+			return None
+		if operator == "+":
+			return (left + right) & 0xFFFF
+		if operator == "-":
+			return (left - right) & 0xFFFF
+		if operator == "*":
+			return (left * right) & 0xFFFF
+		if operator == "&":
+			return left & right
+		if operator == "|":
+			return left | right
+		if operator == "^":
+			return left ^ right
+		if operator == "/" and right != 0:
+			return left // right
+		if operator == "%" and right != 0:
+			return left % right
+		return None
+
+if __name__ == "__main__":
+	for op in "+-*/%&|^!":
+		print(op,Calculator.calculate(42,op,5),Calculator.calculate(42,op,0))
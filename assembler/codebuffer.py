@@ -0,0 +1,68 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		codebuffer.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		20th December 2018
+#		Purpose :	Growable byte buffer for code and data segments
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+# ***************************************************************************************
+#			A segment of memory at a base address, filled from the bottom up
+# ***************************************************************************************
+
+class CodeBuffer(object):
+	def __init__(self,baseAddress,size = 0x4000):
+		self.baseAddress = baseAddress
+		self.buffer = bytearray(size)									# preallocated, doubles when full
+		self.pointer = 0 												# offset of next free byte
+	#
+	#		Address of the next free byte
+	#
+	def getAddress(self):
+		return self.baseAddress + self.pointer
+	#
+	#		Number of bytes used
+	#
+	def getSize(self):
+		return self.pointer
+	#
+	#		Append a sequence of bytes
+	#
+	def append(self,data):
+		end = self.pointer + len(data)
+		while end > len(self.buffer):									# make more space if required
+			self.buffer.extend(bytes(len(self.buffer)))
+		self.buffer[self.pointer:end] = data
+		self.pointer = end
+	#
+	#		Reserve space, which is zero because the buffer is zeroed.
+	#
+	def reserve(self,count):
+		address = self.getAddress()
+		end = self.pointer + count
+		while end > len(self.buffer):
+			self.buffer.extend(bytes(len(self.buffer)))
+		self.pointer = end
+		return address
+	#
+	#		Read and write bytes/words at an address already written.
+	#
+	def readByte(self,address):
+		return self.buffer[address - self.baseAddress]
+	def readWord(self,address):
+		offset = address - self.baseAddress
+		return self.buffer[offset] + (self.buffer[offset+1] << 8)
+	def writeByte(self,address,data):
+		self.buffer[address - self.baseAddress] = data & 0xFF
+	def writeWord(self,address,data):
+		offset = address - self.baseAddress
+		self.buffer[offset] = data & 0xFF
+		self.buffer[offset+1] = (data >> 8) & 0xFF
+	#
+	#		Get the contents as bytes
+	#
+	def getBytes(self):
+		return bytes(self.buffer[:self.pointer])
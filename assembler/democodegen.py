@@ -9,6 +9,8 @@
 # ***************************************************************************************
 # ***************************************************************************************
 
+from stringpool import *
+
 # ***************************************************************************************
 #
 #					Code generator for an imaginary CPU, for testing
@@ -16,40 +18,55 @@
 # ***************************************************************************************
 
 class DemoCodeGenerator(object):
-	def __init__(self,optimise = False):
-		self.addr = 0x1000						# code space
-		self.memoryAddr = 0x3000 				# uninitialised data
+	def __init__(self,optimise = False,codeBase = 0x1000,dataBase = 0x3000):
+		self.optimise = optimise 				# put a peephole optimiser in front
+		self.addr = codeBase					# code space
+		self.memoryAddr = dataBase 				# data, variables and strings
+		self.stringPool = StringPool()
+		self.tempVariable = None 				# variable kept in b, if any
 		self.opNames = {}
 		for op in "+add;-sub;*mult;/div;%mod;&and;|or;^xor".split(";"):
 			self.opNames[op[0]] = op[1:]
 		self.jumpTypes = { "":"jmp","#":"jnz","=":"jz","+":"jpe","-":"jmi" }
 	#
+	#		Addresses are absolute, not relocated by a linker.
+	#
+	def isRelocatable(self):
+		return False
+	#
 	#		Get current address in code space.
 	#
 	def getAddress(self):
 		return self.addr
 	#
-	#		Allocate memory for a variable.
+	#		Allocate memory for words of variables, a block is just reserved.
 	#
 	def allocate(self,count = 1):
 		address = self.memoryAddr
-		for i in range(0,count):
+		if count == 1:
 			print("${0:06x} : dw    0".format(self.memoryAddr))	
-			self.memoryAddr += 2
+		else:
+			print("${0:06x} : ds    ${1:04x}".format(self.memoryAddr,count * 2))
+		self.memoryAddr += count * 2
 		return address
 	#
-	#		Place an ASCIIZ string constant ... somewhere .... return its address
+	#		Place an ASCIIZ string constant with the data, once, return its address
 	#
 	def stringConstant(self,str):
-		print("${0:06x} : db    '{1}',0".format(self.addr,str))		# can be inline, or elsewhere
-		addr = self.addr
-		self.addr = self.addr + len(str) + 1
-		return addr
+		address = self.stringPool.find(str)
+		if address is None:
+			print("${0:06x} : db    '{1}',0".format(self.memoryAddr,str))
+			address = self.memoryAddr
+			self.stringPool.add(str,address)
+			self.memoryAddr += len(str) + 1
+		return address
 	#
 	#		Load Accumulator with constant or term.
 	#
 	def loadARegister(self,term):
-		if term[0]:
+		if term[0] and term[1] == self.tempVariable:
+			print("${0:06x} : mov   a,b".format(self.addr))
+		elif term[0]:
 			print("${0:06x} : ldr   a,(${1:04x})".format(self.addr,term[1]))
 		else:
 			print("${0:06x} : ldr   a,#${1:04x}".format(self.addr,term[1]))
@@ -59,12 +76,16 @@ class DemoCodeGenerator(object):
 	#
 	def binaryOperation(self,operator,term):
 		if operator == "!" or operator == "?":							# indirect, we do add then read
-			self.binaryOperation("+",term)								# add will optimise a bit
+			if term[0] or term[1] != 0 or not self.optimise:			# no add needed for +0
+				self.binaryOperation("+",term)
 			print("${0:06x} : ldr.{1} a,[a]".format(self.addr,"w" if operator == "!" else "b"))
 			self.addr += 1
 			return
 		operator = self.opNames[operator]								# convert op to opcode name
-		if term[0]:
+		if term[0] and term[1] == self.tempVariable:
+			print("${0:06x} : {1:4}  a,b".format(self.addr,operator))
+			self.addr += 1
+		elif term[0]:
 			print("${0:06x} : {1:4}  a,(${2:04x})".format(self.addr,operator,term[1]))
 			self.addr += 1
 		else:
@@ -74,27 +95,60 @@ class DemoCodeGenerator(object):
 	#		Save A at the address given
 	#
 	def saveDirect(self,address):
-		print("${0:06x} : str   a,(${1:04x})".format(self.addr,address))
+		if address is not None and address == self.tempVariable:
+			print("${0:06x} : mov   b,a".format(self.addr))
+			self.addr += 1
+			return None
+		if address is None:												# address not known yet
+			print("${0:06x} : str   a,(?????)".format(self.addr))
+		else:
+			print("${0:06x} : str   a,(${1:04x})".format(self.addr,address))
 		self.addr += 1
+		return self.addr-1
+	#
+	#		Keep the variable at an address in the temp register rather than memory,
+	#		or stop if None.
+	#
+	def setTempVariable(self,address):
+		self.tempVariable = address
 	#
 	#		Save temp register indirect through A, byte or word, and put temp back in A
+	#		unless it is not going to be used.
 	#
-	def saveTempIndirect(self,isWord):
+	def saveTempIndirect(self,isWord,restoreA = True):
 		print("${0:06x} : str.{1} b,[a]".format(self.addr," " if isWord else "b"))
-		print("${0:06x} : tba".format(self.addr+1))	
-		self.addr += 2
+		self.addr += 1
+		if restoreA:
+			print("${0:06x} : tba".format(self.addr))	
+			self.addr += 1
+	#
+	#		Copy A to the temp register, A value unknown after this unless kept.
+	#
+	def copyToTemp(self,keepA = False):
+		print("${0:06x} : {1}".format(self.addr,"mov   b,a" if keepA else "tab"))
+		self.addr += 1
 	#
-	#		Copy A to the temp register, A value unknown after this.	
+	#		Add the temp register to A
 	#
-	def copyToTemp(self):
-		print("${0:06x} : tab".format(self.addr))
+	def addTemp(self):
+		print("${0:06x} : add   a,b".format(self.addr))
+		self.addr += 1
+	#
+	#		Logical shift A left or right
+	#
+	def shiftOperation(self,isLeft,count):
+		print("${0:06x} : {1}   a,#{2}".format(self.addr,"shl" if isLeft else "shr",count))
 		self.addr += 1
 	#
 	#		Compile a call to a procedure (call should protect 'A')
 	#
 	def callProcedure(self,address):
-		print("${0:06x} : call  ${1:06x}".format(self.addr,address))
+		if address is None:												# forward reference
+			print("${0:06x} : call  ?????".format(self.addr))
+		else:
+			print("${0:06x} : call  ${1:06x}".format(self.addr,address))
 		self.addr += 1
+		return self.addr-1
 	#
 	#		Return from procedure (should protect A)
 	#
@@ -117,6 +171,11 @@ class DemoCodeGenerator(object):
 	def patchJump(self,jumpAddr,target):
 		print("${0:06x} : (Set target to ${1:06x})".format(jumpAddr,target))
 	#
+	#		Patch the address in a call or save compiled without one.
+	#
+	def patchAddress(self,instrAddr,address):
+		print("${0:06x} : (Set address to ${1:06x})".format(instrAddr,address))
+	#
 	#		Compile the top of a for loop.
 	#
 	def forTopCode(self,indexVar):
@@ -134,3 +193,27 @@ class DemoCodeGenerator(object):
 		print("${0:06x} : pop   a".format(self.addr))					# pop off stack, jump if not done
 		print("${0:06x} : jnz   ${1:06x}".format(self.addr+1,loopAddress))
 		self.addr += 2
+	#
+	#		Compile the top of a for loop counting in the c register. count is the
+	#		constant count or None if it is in A. A is only set to the index if setA.
+	#
+	def counterTopCode(self,indexVar,count,setA):
+		if count is None:
+			print("${0:06x} : mov   c,a".format(self.addr))
+		else:
+			print("${0:06x} : ldr   c,#${1:04x}".format(self.addr,count))
+		loop = self.addr + 1
+		print("${0:06x} : dec   c".format(loop))
+		self.addr += 2
+		if setA:
+			print("${0:06x} : mov   a,c".format(self.addr))
+			self.addr += 1
+			if indexVar is not None:
+				self.saveDirect(indexVar.getValue())
+		return loop
+	#
+	#		Compile the bottom of a for loop counting in the c register.
+	#
+	def counterBottomCode(self,loopAddress):
+		print("${0:06x} : jcnz  ${1:06x}".format(self.addr,loopAddress))
+		self.addr += 1
@@ -20,38 +20,84 @@ class Dictionary(object):
 	def __init__(self):
 		self.globals = {}
 		self.locals = {}
+		self.scopes = [{}] 												# locals defined, name -> one hidden
+		self.private = [] 												# names of _ globals in this module
+		self.undefined = [] 											# procedures added undefined
 	#
-	#	Add an identifier to the dictionary.
+	#	Add an identifier to the dictionary. Names are already lower case.
 	#
 	def add(self,identifier):
-		target = self.globals if identifier.isGlobal() else self.locals # decide where its going
-		if identifier.getName() in target: 								# check for duplication
-			raise AssemblerException("Duplicate idenifier "+identifier.getName())
-		target[identifier.getName()] = identifier 						# store
+		name = identifier.getName()
+		if identifier.isGlobal():
+			if name in self.globals: 									# check for duplication
+				raise AssemblerException("Duplicate idenifier "+name)
+			self.globals[name] = identifier
+			if name[0] == '_':
+				self.private.append(name)
+			if isinstance(identifier,ProcedureIdentifier) and not identifier.isDefined():
+				self.undefined.append(identifier)
+		else:
+			scope = self.scopes[-1]
+			if name in scope:
+				raise AssemblerException("Duplicate idenifier "+name)
+			scope[name] = self.locals.get(name) 						# hides any in an outer scope
+			self.locals[name] = identifier
 	#
-	#	Get an identifier from the dictionary.
+	#	Get an identifier from the dictionary, locals have priority over globals.
 	#
 	def find(self,identifier):
-		identifier = identifier.strip().lower()							# get ID
-		if identifier in self.locals: 									# locals have priority
-			return self.locals[identifier]
-		if identifier in self.globals:									# over globals
-			return self.globals[identifier]
-		return None
+		ident = self.locals.get(identifier)
+		return ident if ident is not None else self.globals.get(identifier)
+	#
+	#	Get all procedures which have been called but not defined.
+	#
+	def getUndefinedProcedures(self):
+		self.undefined = [x for x in self.undefined if not x.isDefined()]
+		return self.undefined
+	#
+	#	Get the globals other modules can use, defined procedures, variables and arrays.
+	#
+	def getExports(self):
+		exports = []
+		for ident in self.globals.values():
+			if isinstance(ident,ProcedureIdentifier):
+				if ident.isDefined():
+					exports.append(ident)
+			elif isinstance(ident,VariableIdentifier) and not isinstance(ident,ExternalIdentifier):
+				exports.append(ident)
+			elif isinstance(ident,ArrayIdentifier):
+				exports.append(ident)
+		return exports
+	#
+	#	Locals are in scopes, leaving one puts back any locals it hid.
+	#
+	def openScope(self):
+		self.scopes.append({})
+	def closeScope(self):
+		scope = self.scopes.pop()
+		for name in reversed(list(scope.keys())):
+			if scope[name] is None:
+				del self.locals[name]
+			else:
+				self.locals[name] = scope[name]
+		if len(self.scopes) == 0:
+			self.scopes.append({})
 	#
 	#	Purge all locals
 	#
 	def purgeLocals(self):
-		self.locals = {}
+		while len(self.scopes) > 1:
+			self.closeScope()
+		self.closeScope()
 	#
 	#	Purge at end of module ; all locals and any identifier beginning with an underscore
 	#
 	def purgeEndModule(self):
 		self.purgeLocals()
-		globals = self.globals
-		self.globals = {}
-		for key in [x for x in globals.keys() if x[0] != '_']:
-			self.globals[key] = globals[key]
+		for name in self.private:
+			del self.globals[name]
+		self.private = []
+		self.undefined = [x for x in self.undefined if x.getName()[0] != '_']
 	#
 	#	Convert dictionary to text to print
 	#
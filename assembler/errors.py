@@ -14,16 +14,37 @@
 # ***************************************************************************************
 
 class AssemblerException(Exception):
-	def __init__(self,message):
+	def __init__(self,message,fileName = None,lineNumber = None,column = None):
+		Exception.__init__(self,message)
 		self.message = message
+		self.fileName = fileName
+		self.lineNumber = lineNumber
+		self.column = column
+	#
+	#		Rebuild with the location when passed back from a worker process.
+	#
+	def __reduce__(self):
+		return (AssemblerException,(self.message,self.fileName,self.lineNumber,self.column))
+	#
+	#		Set where the error happened, if the raiser didn't know.
+	#
+	def setLocation(self,fileName,lineNumber,column = None):
+		if self.lineNumber is None:
+			self.fileName = fileName
+			self.lineNumber = lineNumber
+			self.column = column
+	#
 	def get(self):
-		return "{0} ({1}:{2})".format(self.message,AssemblerException.FILENAME,AssemblerException.LINENUMBER)
-
-AssemblerException.FILENAME = "test"
-AssemblerException.LINENUMBER = 42
+		if self.lineNumber is None:
+			return self.message
+		if self.column is None:
+			return "{0} ({1}:{2})".format(self.message,self.fileName,self.lineNumber)
+		return "{0} ({1}:{2}:{3})".format(self.message,self.fileName,self.lineNumber,self.column)
 
 if __name__ == "__main__":
 	ex = AssemblerException("Division by 42 error")
 	print(ex.get())
+	ex.setLocation("test",42,7)
+	print(ex.get())
 	raise ex
 	
\ No newline at end of file
@@ -9,13 +9,17 @@
 # ***************************************************************************************
 # ***************************************************************************************
 
+import sys
+
 # ***************************************************************************************
 #								Root identifier class
 # ***************************************************************************************
 
 class Identifier(object):
+	__slots__ = [ "name","value","isGlobalIdentifier" ]					# no __dict__, there are lots
+	#
 	def __init__(self,name,value,isGlobal = True):
-		self.name = name.strip().lower()
+		self.name = sys.intern(name.strip().lower())
 		self.value = value
 		self.isGlobalIdentifier = isGlobal
 	#
@@ -35,6 +39,7 @@ class Identifier(object):
 # ***************************************************************************************
 
 class ConstantIdentifier(Identifier):
+	__slots__ = []
 	def __init__(self,name,value):
 		Identifier.__init__(self,name,value,True)						# Constants global
 	def getTypeName(self):	
@@ -45,6 +50,7 @@ class ConstantIdentifier(Identifier):
 # ***************************************************************************************
 
 class AddressIdentifier(Identifier):
+	__slots__ = []
 	def getTypeName(self):
 		return "AddressIdentifier"
 
@@ -53,28 +59,83 @@ class AddressIdentifier(Identifier):
 # ***************************************************************************************
 
 class VariableIdentifier(AddressIdentifier):
+	__slots__ = []
 	def getTypeName(self):
 		return "VariableIdentifier"
 
+# ***************************************************************************************
+#			Variable in another module, the value is the code generator's import
+# ***************************************************************************************
+
+class ExternalIdentifier(VariableIdentifier):
+	__slots__ = []
+	def getTypeName(self):
+		return "ExternalIdentifier"
+
+# ***************************************************************************************
+#			Identifier representing an array, the value is its address
+# ***************************************************************************************
+
+class ArrayIdentifier(AddressIdentifier):
+	__slots__ = [ "size" ]
+	def __init__(self,name,address,size,isGlobal = True):
+		AddressIdentifier.__init__(self,name,address,isGlobal)
+		self.size = size 												# in bytes
+	def getTypeName(self):
+		return "ArrayIdentifier"
+	def getSize(self):
+		return self.size
+	def toString(self):
+		return AddressIdentifier.toString(self)+" [{0} bytes]".format(self.size)
+
 # ***************************************************************************************
 #					  Identifier representing a procedure
 # ***************************************************************************************
 
 class ProcedureIdentifier(AddressIdentifier):
-	def __init__(self,name,address,paramAddress,paramCount):
+	__slots__ = [ "paramAddress","paramCount","references","registerParameter" ]
+	def __init__(self,name,address,paramAddress,paramCount,registerParameter = False):
 		AddressIdentifier.__init__(self,name,address,True)
 		self.paramAddress = paramAddress
 		self.paramCount = paramCount
+		self.references = [] 											# forward refs [instruction,param#]
+		self.registerParameter = registerParameter 						# last parameter in temp register
 	def getTypeName(self):
 		return "ProcedureIdentifier"
 	def getParameterCount(self):
 		return self.paramCount
 	def getParameterBaseAddress(self):
 		return self.paramAddress
+	#
+	#		A leaf procedure may take its last parameter in the temp register rather
+	#		than its parameter memory.
+	#
+	def hasRegisterParameter(self):
+		return self.registerParameter
+	#
+	#		Forward referenced procedures are created with address None, the
+	#		parameter count is the count used in the first call.
+	#
+	def isDefined(self):
+		return self.value is not None
+	def addReference(self,instrAddr,paramNumber):
+		self.references.append([instrAddr,paramNumber])
+	def getReferences(self):
+		return self.references
+	def define(self,address,paramAddress,paramCount,registerParameter = False):
+		self.value = address
+		self.paramAddress = paramAddress
+		self.paramCount = paramCount
+		self.references = []
+		self.registerParameter = registerParameter
 	def toString(self):
+		if not self.isDefined():
+			return "{0} (undefined) 'ProcedureIdentifier'".format(self.getName())
 		s = AddressIdentifier.toString(self)
 		if self.getParameterCount() > 0:
 			s = s + " ({0} params @ ${1:04x})".format(self.getParameterCount(),self.getParameterBaseAddress())
+		if self.hasRegisterParameter():
+			s = s + " (last in register)"
 		return s
 
 if __name__ == "__main__":
@@ -0,0 +1,151 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		imagewriter.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		23rd December 2018
+#		Purpose :	Writes the paged boot.img
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+import os,mmap
+from errors import *
+
+# ***************************************************************************************
+#
+#		The boot.img is what bootloader.asm loads. $8000-$BFFF then $C000-$FFFF
+#		with each pair of 8k pages 32/33 .. 94/95 mapped there, 16k each.
+#
+#		Data is written at (page,address). Page None is $8000-$BFFF, otherwise it
+#		is the first (even) page of a pair and the address is in $C000-$FFFF.
+#		Anything not written when the image is closed is zero.
+#
+# ***************************************************************************************
+
+class PagedImage(object):
+	def __init__(self):
+		self.image = bytearray(PagedImage.SIZE)
+		self.written = [[] for i in range(0,1+PagedImage.PAGECOUNT)]	# [start,end] written, per block
+	#
+	#		Write data at a page and address
+	#
+	def write(self,page,address,data):
+		offset = self.getOffset(page,address,len(data))
+		self.written[offset // PagedImage.PAGESIZE].append([offset,offset+len(data)])
+		self.update(offset,data)
+	#
+	#		Convert page and address to an offset in the image.
+	#
+	def getOffset(self,page,address,size):
+		if page is None:
+			base = 0x8000
+			offset = address - 0x8000
+		else:
+			if page < PagedImage.FIRSTPAGE or page > PagedImage.LASTPAGE or page % 2 != 0:
+				raise AssemblerException("Bad page {0}".format(page))
+			base = 0xC000
+			offset = ((page - PagedImage.FIRSTPAGE) // 2 + 1) * PagedImage.PAGESIZE + address - 0xC000
+		if address < base or address + size > base + PagedImage.PAGESIZE:
+			raise AssemblerException("Bad address ${0:04x} for page {1}".format(address,page))
+		return offset
+	#
+	#		Write data at an image offset.
+	#
+	def update(self,offset,data):
+		self.image[offset:offset+len(data)] = data
+	#
+	#		Zero everything which has not been written.
+	#
+	def close(self):
+		for block in range(0,len(self.written)):
+			start = block * PagedImage.PAGESIZE
+			for written in sorted(self.written[block]) + [[start+PagedImage.PAGESIZE,None]]:
+				if written[0] > start:
+					self.update(start,bytes(written[0]-start))
+				start = max(start,written[1] or 0)
+			self.written[block] = []
+	#
+	def getBytes(self):
+		return bytes(self.image)
+
+PagedImage.PAGESIZE = 0x4000 											# bytes per page pair
+PagedImage.FIRSTPAGE = 32 												# 8k pages loaded
+PagedImage.LASTPAGE = 94
+PagedImage.PAGECOUNT = (PagedImage.LASTPAGE - PagedImage.FIRSTPAGE) // 2 + 1
+PagedImage.SIZE = PagedImage.PAGESIZE * (1 + PagedImage.PAGECOUNT)
+
+# ***************************************************************************************
+#
+#		Writes straight into boot.img, which is memory mapped. Bytes are only
+#		changed if they are different, so only the parts of the file which have
+#		changed since the last build are written back to the disk.
+#
+# ***************************************************************************************
+
+class ImageWriter(PagedImage):
+	def __init__(self,fileName = "boot.img"):
+		self.written = [[] for i in range(0,1+PagedImage.PAGECOUNT)]
+		self.changed = set() 											# blocks changed
+		self.handle = open(fileName,"r+b" if os.path.isfile(fileName) else "w+b")
+		if os.path.getsize(fileName) != PagedImage.SIZE:				# new or wrong size
+			self.handle.truncate(PagedImage.SIZE)
+		self.image = mmap.mmap(self.handle.fileno(),PagedImage.SIZE)
+	#
+	def update(self,offset,data):
+		if self.image[offset:offset+len(data)] != data:
+			self.image[offset:offset+len(data)] = data
+			self.changed.add(offset // PagedImage.PAGESIZE)
+	#
+	#		Zero anything not written and close the file.
+	#
+	def close(self):
+		PagedImage.close(self)
+		self.image.flush()
+		self.abort()
+	#
+	#		Close the file without zeroing or flushing anything.
+	#
+	def abort(self):
+		self.image.close()
+		self.handle.close()
+	#
+	#		Write all of an image built in memory and close the file. The file is
+	#		closed even if this fails.
+	#
+	def copy(self,image):
+		try:
+			data = image.getBytes()
+			for block in range(0,len(self.written)):
+				offset = block * PagedImage.PAGESIZE
+				self.written[block].append([offset,offset+PagedImage.PAGESIZE])
+				self.update(offset,data[offset:offset+PagedImage.PAGESIZE])
+			self.close()
+		except:
+			self.abort()
+			raise
+	#
+	#		Which 16k blocks have changed, 0 is $8000-$BFFF.
+	#
+	def getChanged(self):
+		return sorted(self.changed)
+
+if __name__ == "__main__":
+	for i in range(0,2):
+		writer = ImageWriter("test.img")
+		writer.write(None,0x8000,bytes([0xC3,0x00,0x80]))
+		writer.write(32,0xC000,b"page 32")
+		writer.write(34,0xE000+i,b"page 35")
+		writer.close()
+		print(writer.getChanged())
+	h = open("test.img","rb")
+	image = h.read()
+	h.close()
+	print(len(image),image[0:3],image[0x4000:0x4007],image[0xA000:0xA009])
+	paged = PagedImage() 												# built in memory, then copied
+	paged.write(None,0x8000,bytes([0xC3,0x00,0x80]))
+	paged.write(32,0xC000,b"page 32")
+	writer = ImageWriter("test.img")
+	writer.copy(paged)
+	print(writer.getChanged())
+	os.remove("test.img")
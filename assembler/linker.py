@@ -0,0 +1,425 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		linker.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		23rd December 2018
+#		Purpose :	Links object modules into a boot.img
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+import bisect
+from errors import *
+from identifiers import *
+from objectmodule import *
+from z80codegen import *
+from imagewriter import *
+from stringpool import *
+
+# ***************************************************************************************
+#
+#		Lays out the modules and fixes the relocations. $8000 jumps to the boot
+#		code, then comes the runtime library, the code of each module in order,
+#		the boot code, and then the data of each module in order. Then the strings
+#		of all the modules, pooled so each is only there once, and the variables
+#		of each module, which are zero so are not written.
+#
+#		If the code does not fit in $8000-$BFFF procedures are placed in the page
+#		pairs mapped at $C000-$FFFF instead. Procedures which call each other are
+#		kept in the same page, and those called most from elsewhere stay in the
+#		$8000-$BFFF area. A call to a procedure in another page goes through a far
+#		call stub, which maps that page, calls it, and maps the caller's back.
+#
+# ***************************************************************************************
+
+class Linker(object):
+	def __init__(self):
+		self.symbols = {}												# name -> [module number,identifier]
+	#
+	#		Link a list of object modules into a paged image, which is closed and
+	#		returned. If no image is given it is built in memory.
+	#
+	def link(self,modules,image = None):
+		image = PagedImage() if image is None else image
+		self.modules = [self.createRuntime()] + modules
+		self.createSymbolTable()
+		for n in range(0,len(self.modules)):
+			self.checkImports(n)
+		self.createChunks()
+		self.createCallGraph()
+		self.createStringPool()
+		self.placeCode()
+		image.write(None,0x8000,bytes([0xC3,self.bootAddress & 0xFF,self.bootAddress >> 8]))
+		for n in range(0,len(self.modules)):
+			for chunk in self.chunks[n]:
+				image.write(chunk.page,chunk.address,self.relocateChunk(chunk))
+			image.write(None,self.dataBase[n],self.modules[n].data)
+		image.write(None,self.stringBase,bytes(self.stringData))
+		pageRoutine = self.getAddress(Z80CodeGenerator.PAGING[0])
+		pageVariable = self.getAddress(Z80CodeGenerator.PAGING[1])
+		for chunk in self.stubs:										# far call stubs
+			image.write(None,chunk.stub,bytes([								\
+				0x3A,pageVariable & 0xFF,pageVariable >> 8,0xF5,				\
+				0x3E,chunk.page,0xCD,pageRoutine & 0xFF,pageRoutine >> 8,		\
+				0xCD,chunk.address & 0xFF,chunk.address >> 8,					\
+				0xF1,0xC3,pageRoutine & 0xFF,pageRoutine >> 8 ]))
+		boot = []
+		for chunk in self.bootChunks:
+			address = chunk.address if chunk.page is None else chunk.stub
+			boot = boot + [0xCD,address & 0xFF,address >> 8]			# call <name>.boot
+		image.write(None,self.bootAddress,bytes(boot+[0x18,0xFE]))		# jr $
+		image.close()
+		return image
+	#
+	#		Build the runtime library module, which exports the library routines.
+	#
+	def createRuntime(self):
+		codeGenerator = Z80CodeGenerator(relocatable = True)
+		runtime = codeGenerator.compileRuntime()
+		routine,page = codeGenerator.compilePaging()
+		module = ObjectModule("<runtime>")
+		module.code = codeGenerator.getCode()
+		module.data = codeGenerator.getData()
+		module.bss = codeGenerator.getBSSSize()
+		module.relocations = codeGenerator.getRelocations()
+		for operator in Z80CodeGenerator.RUNTIME.keys():
+			module.exports.append(ProcedureIdentifier(Z80CodeGenerator.RUNTIME[operator],runtime[operator],None,2))
+		module.exports.append(ProcedureIdentifier(Z80CodeGenerator.PAGING[0],routine,None,0))
+		module.exports.append(VariableIdentifier(Z80CodeGenerator.PAGING[1],page,True))
+		return module
+	#
+	#		Collect the exports of all the modules.
+	#
+	def createSymbolTable(self):
+		self.symbols = {}
+		for n in range(0,len(self.modules)):
+			for ident in self.modules[n].exports:
+				if ident.getName() in self.symbols:
+					other = self.modules[self.symbols[ident.getName()][0]].getName()
+					raise AssemblerException("Global {0} is in both {1} and {2}".format(ident.getName(),other,self.modules[n].getName()))
+				self.symbols[ident.getName()] = [n,ident]
+	#
+	#		Check a module's imports exist and are what it thinks they are.
+	#
+	def checkImports(self,n):
+		module = self.modules[n]
+		for name in module.imports:
+			if name.endswith(ObjectModule.PARAMETERS) or name in Z80CodeGenerator.RUNTIME.values():
+				continue 												# checked with procedure, or library
+			if name not in self.symbols:
+				raise AssemblerException("Global {0} used in {1} is never defined".format(name,module.getName()))
+			ident = self.symbols[name][1]
+			if name in module.calls:
+				if not isinstance(ident,ProcedureIdentifier):
+					raise AssemblerException("{0} called in {1} is not a procedure".format(name,module.getName()))
+				if ident.getParameterCount() != module.calls[name]:
+					raise AssemblerException("Procedure {0} called with wrong parameters in {1}".format(name,module.getName()))
+			elif not isinstance(ident,VariableIdentifier) and not isinstance(ident,ArrayIdentifier):
+				raise AssemblerException("{0} used in {1} is not a variable".format(name,module.getName()))
+	#
+	#		Split each module's code into procedures, and the code between them.
+	#
+	def createChunks(self):
+		self.chunks = []
+		for n in range(0,len(self.modules)):
+			module = self.modules[n]
+			chunks = []
+			position = 0
+			for name,start,end in sorted(module.procedures,key = lambda x:x[1]):
+				start = start & 0xFFFF
+				if start > position:
+					chunks.append(CodeChunk(n,None,position,start))
+				chunks.append(CodeChunk(n,name,start,end & 0xFFFF))
+				position = end & 0xFFFF
+			if position < len(module.code):
+				chunks.append(CodeChunk(n,None,position,len(module.code)))
+			self.chunks.append(chunks)
+		self.chunkStarts = [[x.start for x in chunks] for chunks in self.chunks]
+	#
+	#		Find the chunk containing an offset in a module's code
+	#
+	def findChunk(self,n,offset):
+		return self.chunks[n][max(0,bisect.bisect_right(self.chunkStarts[n],offset)-1)]
+	#
+	#		Count the calls from each chunk to the others, from the call instructions
+	#		in the relocations.
+	#
+	def createCallGraph(self):
+		for n in range(0,len(self.modules)):
+			code = self.modules[n].code
+			for offset,segment in self.modules[n].relocations:
+				if offset > 0 and code[offset-1] == 0xCD:				# call nn
+					target = self.findCode(n,(segment << 16)+code[offset]+(code[offset+1] << 8))
+					if target is not None:
+						caller = self.findChunk(n,offset)
+						callee = self.findChunk(target[0],target[1])
+						if caller is not callee:
+							caller.calls[callee] = caller.calls.get(callee,0) + 1
+							callee.callers[caller] = callee.callers.get(caller,0) + 1
+		self.bootChunks = []
+		for n in range(0,len(self.modules)):
+			for address in self.modules[n].bootProcedures:
+				self.bootChunks.append(self.findChunk(n,address & 0xFFFF))
+	#
+	#		Find the module and code offset a tagged value in module n refers to, None
+	#		if it is not in code.
+	#
+	def findCode(self,n,value):
+		segment = value >> 16
+		if segment == Z80CodeGenerator.CODE:
+			return [n,value & 0xFFFF]
+		if segment == Z80CodeGenerator.DATA or segment == Z80CodeGenerator.BSS or segment == Z80CodeGenerator.STRING:
+			return None
+		name = self.modules[n].imports[segment - Z80CodeGenerator.IMPORT]
+		if name.endswith(ObjectModule.PARAMETERS):
+			return None
+		owner,ident = self.symbols[name]
+		return self.findCode(owner,ident.getValue() + (value & 0xFFFF))
+	#
+	#		Pool the strings of all the modules, longest first so the most are shared,
+	#		and record where each module's strings are in the pool. The strings asked
+	#		for are those the modules used, not the ones pooled here.
+	#
+	def createStringPool(self):
+		self.stringPool = StringPool()
+		self.stringData = bytearray()
+		strings = set([x for module in self.modules for x in module.strings])
+		for string in sorted(strings,key = lambda x:(-len(x),x)):
+			if self.stringPool.find(string) is None:
+				self.stringPool.add(string,len(self.stringData))
+				self.stringData += string.encode("latin-1")+b"\x00"
+		self.stringPool.setRequested([sum(x) for x in zip(*[module.stringsRequested for module in self.modules])])
+		self.stringOffsets = [] 										# [module offsets,pool offsets]
+		for module in self.modules:
+			offsets = [[],[]]
+			offset = 0
+			for string in module.strings:
+				offsets[0].append(offset)
+				offsets[1].append(self.stringPool.getAddress(string))
+				offset += len(string) + 1
+			self.stringOffsets.append(offsets)
+	#
+	#		Convert an offset in a module's strings to one in the pool. It may be
+	#		inside a string, or past its end.
+	#
+	def getStringOffset(self,n,offset):
+		offsets = self.stringOffsets[n]
+		i = max(bisect.bisect_right(offsets[0],offset)-1,0)
+		return offsets[1][i] + offset - offsets[0][i]
+	#
+	#		Decide where all the code goes.
+	#
+	def placeCode(self):
+		procedures = [x for chunks in self.chunks for x in chunks if x.name is not None]
+		bootSize = len(self.bootChunks) * 3 + 2
+		fixed = 3 + bootSize + len(self.stringData) + sum([len(x.data)+x.bss for x in self.modules])
+		fixed += sum([x.getSize() for chunks in self.chunks for x in chunks if x.name is None])
+		self.stubs = []
+		if fixed + sum([x.getSize() for x in procedures]) > PagedImage.PAGESIZE:
+			self.placePages(procedures,PagedImage.PAGESIZE - fixed)
+		address = 0x8003												# now $8000-$BFFF in order
+		for chunks in self.chunks:
+			for chunk in chunks:
+				if chunk.page is None:
+					chunk.address = address
+					address += chunk.getSize()
+		for chunk in self.stubs:
+			chunk.stub = address
+			address += Linker.STUBSIZE
+		self.bootAddress = address 										# calls to boot procedures and jr $
+		address += bootSize
+		self.dataBase = []
+		for module in self.modules:
+			self.dataBase.append(address)
+			address += len(module.data)
+		self.stringBase = address
+		address += len(self.stringData)
+		self.bssBase = []
+		for module in self.modules:
+			self.bssBase.append(address)
+			address += module.bss
+		if address > 0xC000:
+			raise AssemblerException("Out of memory linking")
+	#
+	#		Place procedures in pages. Procedures are grouped by the calls between
+	#		them, up to a page in size. The groups most called from outside stay in
+	#		the unpaged memory, if there is room for them and the stubs, the rest are
+	#		packed into pages, biggest first.
+	#
+	def placePages(self,procedures,space):
+		groups = {}
+		for chunk in procedures:
+			if chunk.getSize() > PagedImage.PAGESIZE:
+				raise AssemblerException("Procedure {0} is too large for a page".format(chunk.name))
+			groups[chunk] = [chunk]
+		links = []														# [calls,chunk,chunk] busiest first
+		for chunk in procedures:
+			for callee in chunk.calls.keys():
+				if callee.name is not None:
+					links.append([chunk.calls[callee],chunk,callee])
+		links.sort(key = lambda x:-x[0])
+		for calls,caller,callee in links:								# merge if it fits in a page
+			group1 = groups[caller]
+			group2 = groups[callee]
+			if group1 is not group2 and self.getSize(group1+group2) <= PagedImage.PAGESIZE:
+				group1 += group2
+				for chunk in group2:
+					groups[chunk] = group1
+		groupList = []
+		for chunk in procedures:										# each group once, in order
+			if groups[chunk][0] is chunk:
+				groupList.append(groups[chunk])
+		groupList.sort(key = lambda x:(-self.getOutsideCalls(x),self.getSize(x)))
+		resident = []
+		for group in groupList:											# fill up unpaged memory
+			if self.getSize(group) <= space:
+				resident.append(group)
+				space -= self.getSize(group)
+		paged = [x for x in groupList if x not in resident]
+		while True:														# if no room for stubs, move out
+			paged.sort(key = lambda x:-self.getSize(x))
+			self.packPages(paged)
+			self.stubs = [x for x in procedures if x.page is not None and self.needsStub(x)]
+			if len(self.stubs) * Linker.STUBSIZE <= space or len(resident) == 0:
+				break
+			group = resident.pop()
+			space += self.getSize(group)
+			paged.append(group)
+		if len(self.stubs) * Linker.STUBSIZE > space:
+			raise AssemblerException("Out of memory for far call stubs")
+	#
+	#		Size of a group, and calls into it from outside it.
+	#
+	def getSize(self,group):
+		return sum([x.getSize() for x in group])
+	def getOutsideCalls(self,group):
+		return sum([chunk.callers[x] for chunk in group for x in chunk.callers.keys() if x not in group])
+	#
+	#		First fit groups into pages, setting the page and address of each procedure.
+	#
+	def packPages(self,groups):
+		pages = []														# bytes used in each page
+		for group in groups:
+			size = self.getSize(group)
+			n = 0
+			while n < len(pages) and pages[n] + size > PagedImage.PAGESIZE:
+				n += 1
+			if n == len(pages):
+				if n == PagedImage.PAGECOUNT:
+					raise AssemblerException("Out of memory, pages are full")
+				pages.append(0)
+			for chunk in group:
+				chunk.page = PagedImage.FIRSTPAGE + n * 2
+				chunk.address = 0xC000 + pages[n]
+				pages[n] += chunk.getSize()
+	#
+	#		A paged procedure needs a stub if it is called from another page, or the
+	#		unpaged memory, or at boot.
+	#
+	def needsStub(self,chunk):
+		if chunk in self.bootChunks:
+			return True
+		return len([x for x in chunk.callers.keys() if x.page != chunk.page]) > 0
+	#
+	#		Get the code of a chunk with the addresses fixed.
+	#
+	def relocateChunk(self,chunk):
+		module = self.modules[chunk.module]
+		code = bytearray(module.code[chunk.start:chunk.end])
+		for offset,segment in module.relocations:
+			if offset >= chunk.start and offset < chunk.end:
+				value = (segment << 16) + module.code[offset] + (module.code[offset+1] << 8)
+				address = self.address(chunk.module,value)
+				if module.code[offset-1] == 0xCD:						# call, may be to another page
+					target = self.findCode(chunk.module,value)
+					callee = None if target is None else self.findChunk(target[0],target[1])
+					if callee is not None and callee.page is not None and callee.page != chunk.page:
+						address = callee.stub
+				code[offset-chunk.start] = address & 0xFF
+				code[offset-chunk.start+1] = address >> 8
+		return code
+	#
+	#		Convert a tagged address in module n to an absolute one.
+	#
+	def address(self,n,value):
+		segment = value >> 16
+		offset = value & 0xFFFF
+		if segment == Z80CodeGenerator.CODE:
+			chunk = self.findChunk(n,offset)
+			return (chunk.address + offset - chunk.start) & 0xFFFF
+		if segment == Z80CodeGenerator.DATA:
+			return (self.dataBase[n] + offset) & 0xFFFF
+		if segment == Z80CodeGenerator.BSS:
+			return (self.bssBase[n] + offset) & 0xFFFF
+		if segment == Z80CodeGenerator.STRING:
+			return (self.stringBase + self.getStringOffset(n,offset)) & 0xFFFF
+		name = self.modules[n].imports[segment - Z80CodeGenerator.IMPORT]
+		if name.endswith(ObjectModule.PARAMETERS):						# parameters of a procedure
+			owner,ident = self.symbols[name[:-1]]
+			target = ident.getParameterBaseAddress()
+		else:
+			owner,ident = self.symbols[name]
+			target = ident.getValue()
+		return (self.address(owner,target) + offset) & 0xFFFF
+	#
+	#		Absolute address of a global after linking, and its page if paged.
+	#
+	def getAddress(self,name):
+		owner,ident = self.symbols[name]
+		return self.address(owner,ident.getValue())
+	def getPage(self,name):
+		owner,ident = self.symbols[name]
+		code = self.findCode(owner,ident.getValue())
+		return None if code is None else self.findChunk(code[0],code[1]).page
+	#
+	#		Print the addresses of all the globals.
+	#
+	def toString(self):
+		map = []
+		for name in sorted(self.symbols.keys()):
+			page = self.getPage(name)
+			map.append("${1:04x} {0}{2}\n".format(name,self.getAddress(name),"" if page is None else " (page {0})".format(page)))
+		return "".join(map)
+
+Linker.STUBSIZE = 16 													# bytes in a far call stub
+
+# ***************************************************************************************
+#				Part of a module's code, either a procedure or not
+# ***************************************************************************************
+
+class CodeChunk(object):
+	def __init__(self,module,name,start,end):
+		self.module = module 											# module number
+		self.name = name 												# procedure name or None
+		self.start = start 												# offsets in module code
+		self.end = end
+		self.page = None 												# where it goes, None not paged
+		self.address = None
+		self.stub = None 												# far call stub address
+		self.calls = {} 												# chunk -> number of calls
+		self.callers = {}
+	#
+	def getSize(self):
+		return self.end - self.start
+
+if __name__ == "__main__":
+	from assembler import *
+	sources = [ """
+		global total
+		proc add(n) { total+n>total }
+		proc main.boot() { 0>total add(40) count(2) both(1,2) }
+	""","""
+		global _times global message
+		proc count(n) { n>_times for (_times) { add(1) } "done">message }
+		proc both(a,b) { a+b+total>total }
+	""" ]
+	modules = []
+	for n in range(0,len(sources)):										# the second is optimised, so both()
+		asm = Assembler(Dictionary(),Z80CodeGenerator(n == 1,relocatable = True))	# takes b in a register
+		asm.assembleSource(TextParser(TextArrayStream(sources[n].split("\n"),"module"+str(n))))
+		modules.append(asm.createObject("module"+str(n)))
+		print(modules[-1].toString())
+	linker = Linker()
+	linker.link(modules)
+	print(linker.toString())
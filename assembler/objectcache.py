@@ -0,0 +1,91 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		objectcache.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		23rd December 2018
+#		Purpose :	On disk cache of assembled modules
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+import os,hashlib,struct
+from objectmodule import *
+
+# ***************************************************************************************
+#
+#		Keeps the object module for each source file, in the object file format,
+#		after a key made from the source text and the build options, and the files
+#		it included with a hash of each. Imported globals are only resolved when
+#		linking, so a module's object does not depend on any other module and
+#		changing one module never makes another one be assembled again.
+#
+# ***************************************************************************************
+
+class ObjectCache(object):
+	def __init__(self,directory = ".hlacache"):
+		self.directory = directory
+	#
+	#		Get the key for a source file.
+	#
+	def getKey(self,fileName,optimise):
+		return self.getHash(fileName,"{0}:{1}\n".format(ObjectCache.VERSION,optimise))
+	#
+	#		Hash a file, which is read a chunk at a time.
+	#
+	def getHash(self,fileName,prefix = ""):
+		key = hashlib.sha1(prefix.encode("utf-8"))
+		h = open(fileName,"rb")
+		chunk = h.read(0x10000)
+		while len(chunk) > 0:
+			key.update(chunk)
+			chunk = h.read(0x10000)
+		h.close()
+		return key.hexdigest()
+	#
+	#		Get the object module for a source file, None if it is not cached or
+	#		the source, or any file it includes, has changed. The key is followed by
+	#		the included files and their hashes, then the object module.
+	#
+	def load(self,fileName,key):
+		cacheFile = self.getCacheFile(fileName)
+		if not os.path.isfile(cacheFile):
+			return None
+		h = open(cacheFile,"rb")
+		data = h.read()
+		h.close()
+		if data[:len(key)] != key.encode("ascii"):						# source has changed
+			return None
+		try:
+			reader = ObjectReader(data,len(key))
+			for i in range(0,reader.unpack("<H")[0]):
+				include = reader.bytes(reader.unpack("<H")[0]).decode("utf-8")
+				digest = reader.bytes(len(key)).decode("ascii")
+				if not os.path.isfile(include) or self.getHash(include) != digest:
+					return None 										# included file has changed
+			return ObjectModule.fromBytes(data[reader.position:])
+		except (AssemblerException,struct.error,UnicodeDecodeError):	# damaged, just rebuild it
+			return None
+	#
+	#		Save the object module for a source file.
+	#
+	def save(self,fileName,key,module):
+		if not os.path.isdir(self.directory):
+			os.makedirs(self.directory)
+		out = [ key.encode("ascii"),struct.pack("<H",len(module.includes)) ]
+		for include in module.includes:
+			name = include.encode("utf-8")
+			out += [ struct.pack("<H",len(name)),name,self.getHash(include).encode("ascii") ]
+		cacheFile = self.getCacheFile(fileName)
+		h = open(cacheFile+".tmp","wb")									# so a failed write is not used
+		h.write(b"".join(out)+module.toBytes())
+		h.close()
+		os.replace(cacheFile+".tmp",cacheFile)
+	#
+	#		One cache file per source file, named from its full path.
+	#
+	def getCacheFile(self,fileName):
+		name = hashlib.sha1(os.path.abspath(fileName).encode("utf-8")).hexdigest()
+		return os.path.join(self.directory,name+".obj")
+
+ObjectCache.VERSION = 11 											# change if object modules change
@@ -0,0 +1,196 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		objectmodule.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		23rd December 2018
+#		Purpose :	Assembled module, waiting to be linked
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+import struct
+from errors import *
+from identifiers import *
+
+# ***************************************************************************************
+#
+#		One module assembled by a relocatable code generator. Addresses in the
+#		exports and boot procedures are tagged with their segment as the code
+#		generator creates them.
+#
+#		Imported procedures are two imports, <name> for the code and <name>$ for
+#		the parameters.
+#
+# ***************************************************************************************
+
+class ObjectModule(object):
+	def __init__(self,name):
+		self.name = name
+		self.code = bytes()												# code segment
+		self.data = bytes()												# data segment
+		self.strings = [] 												# strings, in their own segment
+		self.stringsRequested = [0,0] 									# [strings,bytes] used in the source
+		self.bss = 0 													# size of zeroed variable segment
+		self.relocations = [] 											# [code offset,segment tag]
+		self.imports = [] 												# names of imports, tag IMPORT+n
+		self.exports = [] 												# exported identifiers
+		self.calls = {} 												# imported procedure -> param count
+		self.bootProcedures = [] 										# boot procedure addresses in order
+		self.procedures = [] 											# [name,start,end] of each procedure
+		self.includes = [] 												# files included, not in object files
+	#
+	def getName(self):
+		return self.name
+	#
+	#		Convert to the object file format. All values are little endian, addresses
+	#		are 32 bit as they include the segment tag, strings are length prefixed.
+	#		Only the initialised part of the data is stored, the rest is zero, and
+	#		the variables are just a size. Strings are latin-1 with a 16 bit length.
+	#
+	def toBytes(self):
+		data = self.data.rstrip(b"\x00")
+		out = [ ObjectModule.MAGIC, self.packString(self.name) ]
+		out.append(struct.pack("<HHH",len(self.code),len(self.data),self.bss))
+		out += [ self.code, struct.pack("<H",len(data)), data ]
+		out.append(struct.pack("<H",len(self.strings)))
+		for string in self.strings:
+			string = string.encode("latin-1")
+			out += [ struct.pack("<H",len(string)),string ]
+		out.append(struct.pack("<II",*self.stringsRequested))
+		out.append(struct.pack("<H",len(self.relocations)))
+		out += [struct.pack("<HH",x[0],x[1]) for x in self.relocations]
+		out.append(struct.pack("<H",len(self.imports)))
+		out += [self.packString(x) for x in self.imports]
+		out.append(struct.pack("<H",len(self.exports)))
+		for ident in self.exports:										# variables and procedures
+			if isinstance(ident,ProcedureIdentifier):
+				out.append(struct.pack("<BIIB",1,ident.getValue(),ident.getParameterBaseAddress(),ident.getParameterCount()))
+			elif isinstance(ident,ArrayIdentifier):
+				out.append(struct.pack("<BIH",2,ident.getValue(),ident.getSize()))
+			else:
+				out.append(struct.pack("<BI",0,ident.getValue()))
+			out.append(self.packString(ident.getName()))
+		out.append(struct.pack("<H",len(self.calls)))
+		for name in sorted(self.calls.keys()):
+			out += [ self.packString(name),struct.pack("<B",self.calls[name]) ]
+		out.append(struct.pack("<H",len(self.bootProcedures)))
+		out += [struct.pack("<I",x) for x in self.bootProcedures]
+		out.append(struct.pack("<H",len(self.procedures)))
+		for name,start,end in self.procedures:
+			out += [ self.packString(name),struct.pack("<II",start,end) ]
+		return b"".join(out)
+	#
+	def packString(self,s):
+		s = s.encode("utf-8")
+		if len(s) > 0xFFFF:
+			raise AssemblerException("Name too long for an object module")
+		return struct.pack("<H",len(s)) + s
+	#
+	#		Create from the object file format.
+	#
+	@staticmethod
+	def fromBytes(data):
+		if data[:len(ObjectModule.MAGIC)] != ObjectModule.MAGIC:
+			raise AssemblerException("Not an object module")
+		reader = ObjectReader(data,len(ObjectModule.MAGIC))
+		try:
+			module = ObjectModule(reader.string())
+			codeSize,dataSize,module.bss = reader.unpack("<HHH")
+			module.code = reader.bytes(codeSize)
+			data = reader.bytes(reader.unpack("<H")[0])
+			module.data = data + bytes(dataSize - len(data))
+			for i in range(0,reader.unpack("<H")[0]):
+				module.strings.append(reader.bytes(reader.unpack("<H")[0]).decode("latin-1"))
+			module.stringsRequested = list(reader.unpack("<II"))
+			module.relocations = [list(reader.unpack("<HH")) for i in range(0,reader.unpack("<H")[0])]
+			module.imports = [reader.string() for i in range(0,reader.unpack("<H")[0])]
+			for i in range(0,reader.unpack("<H")[0]):
+				kind = reader.unpack("<B")[0]
+				if kind == 1:
+					value,paramBase,paramCount = reader.unpack("<IIB")
+					module.exports.append(ProcedureIdentifier(reader.string(),value,paramBase,paramCount))
+				elif kind == 2:
+					value,size = reader.unpack("<IH")
+					module.exports.append(ArrayIdentifier(reader.string(),value,size))
+				else:
+					value = reader.unpack("<I")[0]
+					module.exports.append(VariableIdentifier(reader.string(),value,True))
+			for i in range(0,reader.unpack("<H")[0]):
+				name = reader.string()
+				module.calls[name] = reader.unpack("<B")[0]
+			module.bootProcedures = [reader.unpack("<I")[0] for i in range(0,reader.unpack("<H")[0])]
+			for i in range(0,reader.unpack("<H")[0]):
+				name = reader.string()
+				module.procedures.append([name]+list(reader.unpack("<II")))
+		except (struct.error,UnicodeDecodeError):
+			raise AssemblerException("Object module is damaged")
+		return module
+	#
+	#		Read and write object files
+	#
+	def write(self,fileName):
+		h = open(fileName,"wb")
+		h.write(self.toBytes())
+		h.close()
+	#
+	@staticmethod
+	def read(fileName):
+		h = open(fileName,"rb")
+		data = h.read()
+		h.close()
+		try:
+			return ObjectModule.fromBytes(data)
+		except AssemblerException as ex:
+			ex.setLocation(fileName,0)
+			raise ex
+	#
+	def toString(self):
+		s = "{0} code ${1:04x} data ${2:04x} bss ${3:04x} {4} strings {5} relocations\n".format(self.name,len(self.code),len(self.data),self.bss,len(self.strings),len(self.relocations))
+		s = s + "\timports " + " ".join(self.imports)+"\n"
+		return s + "".join(["\t{0}\n".format(x.toString()) for x in self.exports])
+
+# ***************************************************************************************
+#							Reads values from an object file
+# ***************************************************************************************
+
+class ObjectReader(object):
+	def __init__(self,data,position = 0):
+		self.data = data
+		self.position = position
+	#
+	def unpack(self,format):
+		values = struct.unpack_from(format,self.data,self.position)
+		self.position += struct.calcsize(format)
+		return values
+	def bytes(self,count):
+		if self.position + count > len(self.data):
+			raise struct.error("object module too short")
+		self.position += count
+		return self.data[self.position-count:self.position]
+	def string(self):
+		return self.bytes(self.unpack("<H")[0]).decode("utf-8")
+
+ObjectModule.PARAMETERS = "$"											# suffix for procedure parameters
+ObjectModule.MAGIC = b"HLA\x07"											# object file header, and version
+
+if __name__ == "__main__":
+	from assembler import *
+	from z80codegen import *
+	asm = Assembler(Dictionary(),Z80CodeGenerator(relocatable = True))
+	asm.assembleSource(TextParser(TextArrayStream("""
+		global total global _count global table[64]
+		proc add(n,m) { total+n>total "hello" _count*3 }
+		proc main.boot() { add(1,2) other(total) "hello" "lo" }
+	""".split("\n"),"demo")))
+	module = asm.createObject("demo")
+	data = module.toBytes()
+	print(len(data),len(module.code)+len(module.data))
+	print(ObjectModule.fromBytes(data).toString())
+	print(ObjectModule.fromBytes(data).toBytes() == data)
+	module.imports.append("x" * 300) 									# long names, damaged names
+	print(ObjectModule.fromBytes(module.toBytes()).imports[-1] == "x" * 300)
+	try:
+		ObjectModule.fromBytes(module.toBytes().replace(b"other",b"\xFFther"))
+	except AssemblerException as ex:
+		print(ex.get())
@@ -0,0 +1,146 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		optimiser.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		21st December 2018
+#		Purpose :	Peephole optimiser sitting in front of a code generator
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+from calculator import *
+
+# ***************************************************************************************
+#
+#		Buffers the accumulator instructions (load, binary operation, save, copy to
+#		temp, save temp indirect) and tidies them up before passing them to the
+#		real code generator. Anything else, which may need the current address or
+#		changes the flow of control, flushes the buffer first and goes straight
+#		through, so addresses are never changed by the optimisation.
+#
+# ***************************************************************************************
+
+class PeepholeOptimiser(object):
+	def __init__(self,codeGenerator):
+		self.codeGenerator = codeGenerator
+		self.pending = [] 												# buffered instructions
+		self.identity = { "+":0,"-":0,"|":0,"^":0,"*":1,"/":1,"&":0xFFFF }
+		self.combine = "+&|^*" 											# (x op a) op b is x op (a op b)
+	#
+	#		Load Accumulator with constant or term.
+	#
+	def loadARegister(self,term):
+		if len(self.pending) > 0:
+			if term[0]:													# just saved there, already in A
+				for instr in reversed(self.pending):
+					if instr[0] != "save":
+						break
+					if instr[1] == term[1]:
+						return
+			while len(self.pending) > 0 and (self.pending[-1][0] == "load" or self.pending[-1][0] == "op"):
+				self.pending.pop()										# value is thrown away, so dead code
+			if len(self.pending) > 0 and self.pending[-1][0] == "indirect":
+				self.pending[-1][2] = False 							# no need to restore A after store
+		self.buffer(["load",term])
+	#
+	#		Perform a binary operation with a constant/term on the accumulator.
+	#
+	def binaryOperation(self,operator,term):
+		if not term[0] and term[1] <= 0xFFFF:							# constant known now, not relocatable
+			value = term[1]
+			if operator in self.identity and value == self.identity[operator]:
+				return 													# does nothing, e.g. add 0
+			if operator == "-":											# subtract constant is add -constant
+				operator = "+"
+				value = (-value) & 0xFFFF
+			term = [False,value]
+			if len(self.pending) > 0:
+				last = self.pending[-1]
+				if last[0] == "load" and not last[1][0]:				# constant op constant
+					result = Calculator.calculate(last[1][1],operator,value)
+					if result is not None:
+						last[1] = [False,result]
+						return
+				if last[0] == "op" and last[1] == operator and not last[2][0] and operator in self.combine:
+					result = Calculator.calculate(last[2][1],operator,value)
+					if result is not None:
+						last[2] = [False,result]
+						if result == self.identity[operator]:			# cancelled out, e.g. +1 -1
+							self.pending.pop()
+						return
+		self.buffer(["op",operator,term])
+	#
+	#		Save A at the address given. If the address is not known it has to go
+	#		straight through as the caller needs the instruction address.
+	#
+	def saveDirect(self,address):
+		if address is None:
+			self.flush()
+			return self.codeGenerator.saveDirect(address)
+		if len(self.pending) > 0 and self.pending[-1][0] == "save" and self.pending[-1][1] == address:
+			return 														# already saved there
+		self.buffer(["save",address])
+	#
+	#		Save temp register indirect through A, byte or word, and put temp back in A
+	#
+	def saveTempIndirect(self,isWord,restoreA = True):
+		self.buffer(["indirect",isWord,restoreA])
+	#
+	#		Copy A to the temp register, A value unknown after this unless kept.
+	#
+	def copyToTemp(self,keepA = False):
+		self.buffer(["temp",keepA])
+	#
+	#		Buffer an instruction. The rules only look at the end of the buffer, so
+	#		once it is long the oldest can go out, keeping it small.
+	#
+	def buffer(self,instr):
+		self.pending.append(instr)
+		if len(self.pending) > PeepholeOptimiser.WINDOW:
+			self.emit(self.pending.pop(0))
+	#
+	#		Send everything buffered to the code generator.
+	#
+	def flush(self):
+		pending = self.pending
+		self.pending = []
+		for instr in pending:
+			self.emit(instr)
+	#
+	def emit(self,instr):
+		if instr[0] == "load":
+			self.codeGenerator.loadARegister(instr[1])
+		elif instr[0] == "op":
+			self.codeGenerator.binaryOperation(instr[1],instr[2])
+		elif instr[0] == "save":
+			self.codeGenerator.saveDirect(instr[1])
+		elif instr[0] == "indirect":
+			self.codeGenerator.saveTempIndirect(instr[1],instr[2])
+		else:
+			self.codeGenerator.copyToTemp(instr[1])
+	#
+	#		Everything else flushes the buffer and goes to the code generator.
+	#
+	def __getattr__(self,name):
+		self.flush()
+		return getattr(self.codeGenerator,name)
+
+PeepholeOptimiser.WINDOW = 16 											# most instructions buffered
+
+if __name__ == "__main__":
+	from textparser import *
+	from assembler import *
+	tas = TextArrayStream("""
+		locvar+5->locvar
+		locvar
+		42+locvar>glbvar?2
+		glbvar!0 glbvar+0*1
+		const1*4+2 -1+6 > locvar
+		"hello" hello(locvar,glbvar?13,42)>locvar
+		local n1 global n2 global _module
+		n1+n2>n2>n1
+		n2
+	""".split("\n"))
+	cm = Assembler(TestDictionary(),DemoCodeGenerator(True))
+	cm.assembleSource(TextParser(tas))
@@ -9,6 +9,7 @@
 # ***************************************************************************************
 # ***************************************************************************************
 
+import os,codecs
 from errors import *
 
 # ***************************************************************************************
@@ -18,6 +19,8 @@ from errors import *
 class Stream(object):
 	def __init__(self):
 		self.inQueue = None
+		self.fileName = None
+		self.lineNumber = 0
 	#
 	#		Next character get
 	#
@@ -38,51 +41,95 @@ class Stream(object):
 	#		Set name, line number
 	#
 	def setFileName(self,fileName):
-		AssemblerException.FILENAME = fileName
+		self.fileName = fileName
 	def setLineNumber(self,lineNumber):
-		AssemblerException.LINENUMBER = lineNumber
+		self.lineNumber = lineNumber
+	def getFileName(self):
+		return self.fileName
+	def getLineNumber(self):
+		return self.lineNumber
 
 # ***************************************************************************************
 #						Stream with information in text array
 # ***************************************************************************************
 
 class TextArrayStream(Stream):
-	def __init__(self,textArray):
+	def __init__(self,textArray,fileName = "<textarray>"):
 		Stream.__init__(self)
-		self.setFileName("<textarray>")
+		self.setFileName(fileName)
 		self.setLineNumber(1)
-		self.currentLine = 0
+		self.textArray = textArray
+		self.lines = None 												# line generator for get()
+		self.currentLine = ""
 		self.currentPos = 0
-		textArray = [x if x.find("//") < 0 else x[:x.find("//")] for x in textArray]
-		self.textArray = [x.strip()+" " for x in textArray]
-		#print(self.textArray)
-
+	#
+	#		Generator giving the lines with comments removed, one at a time, so
+	#		the source is never copied as a whole.
+	#
+	def getLines(self):
+		for line in self.getSourceLines():
+			if line.find("//") >= 0:
+				line = line[:line.find("//")]
+			yield line.strip()+" "
+	#
+	def getSourceLines(self):
+		return iter(self.textArray)
+	#
 	def getRaw(self):
-		if self.currentLine >= len(self.textArray):
-			return ""
-		if self.currentPos >= len(self.textArray[self.currentLine]):
+		if self.lines is None:											# first read, start from line 1
+			self.lines = self.getLines()
+			self.currentLine = next(self.lines,None)
+		while self.currentLine is not None and self.currentPos >= len(self.currentLine):
 			self.currentPos = 0
-			self.currentLine += 1
-			self.setLineNumber(self.currentLine+1)
-		if self.currentLine >= len(self.textArray):
+			self.currentLine = next(self.lines,None)
+			if self.currentLine is not None:
+				self.lineNumber += 1
+		if self.currentLine is None:
 			return ""
-		ch = self.textArray[self.currentLine][self.currentPos]
+		ch = self.currentLine[self.currentPos]
 		self.currentPos += 1
 		return ch
 
 # ***************************************************************************************
-#							Stream with information in file
+#				Stream with information in file, read a chunk at a time
 # ***************************************************************************************
 
 class FileStream(TextArrayStream):
-		def __init__(self,fileName):
-			if not os.path.isfile(fileName):
-				self.setLineNumber(0)
-				self.setFileName(fileName)
-				raise AssemblerException("File not found")
-			h = open(fileName,"r")
-			TextArrayStream.__init__(self,h.readlines())
+	def __init__(self,fileName,chunkSize = 0x10000,encoding = None):
+		if not os.path.isfile(fileName):
+			raise AssemblerException("File not found",fileName,0)
+		TextArrayStream.__init__(self,None,fileName)
+		self.chunkSize = chunkSize
+		self.encoding = encoding or FileStream.ENCODING
+	#
+	#		The file is read as bytes and decoded as it is read, the decoder keeps any
+	#		character split between two chunks. Lines may end in CR LF or LF.
+	#
+	def getSourceLines(self):
+		decoder = codecs.getincrementaldecoder(self.encoding)()
+		h = open(self.getFileName(),"rb")
+		partial = "" 													# part line at end of chunk
+		lineCount = 0 													# lines read, for errors
+		try:
+			chunk = h.read(self.chunkSize)
+			while True:
+				text = partial + decoder.decode(chunk,len(chunk) == 0)
+				lines = text.split("\n")
+				partial = lines.pop()
+				for line in lines:
+					lineCount += 1
+					yield line[:-1] if line.endswith("\r") else line
+				if len(chunk) == 0:
+					break
+				chunk = h.read(self.chunkSize)
+		except UnicodeDecodeError:
+			raise AssemblerException("Bad character encoding, not "+self.encoding,self.getFileName(),lineCount+1)
+		finally:
 			h.close()
+		if partial != "":
+			yield partial[:-1] if partial.endswith("\r") else partial
+
+FileStream.ENCODING = "utf-8-sig" 										# utf-8, skipping any byte order mark
 
 if __name__ == "__main__":
 	tas = TextArrayStream("""
@@ -92,7 +139,7 @@ if __name__ == "__main__":
 	
 	""".split("\n"))
 
-	#tas = FileStream("errors.py")
+	#tas = FileStream("errors.py",256)
 
 	c = tas.get()
 	while c != "":
@@ -0,0 +1,74 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		strength.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		22nd December 2018
+#		Purpose :	Strength reduction of multiply, divide and modulus by constants
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+# ***************************************************************************************
+#
+#		Replaces * / % by a constant with shifts, masks and adds where these are
+#		cheaper than the library routines. Division is unsigned, as it is in the
+#		library.
+#
+# ***************************************************************************************
+
+class StrengthReducer(object):
+	def __init__(self,codeGenerator,maxAdds = 3):
+		self.codeGenerator = codeGenerator
+		self.maxAdds = maxAdds 											# most adds in a shift/add multiply
+	#
+	#		Generate code for A <operator> constant, returns False if it can't be done.
+	#
+	def reduce(self,operator,value):
+		if operator == "*":
+			return self.multiply(value)
+		if operator == "/" and StrengthReducer.isPowerOfTwo(value):		# divide by 2^n is shift right
+			if value > 1:
+				self.codeGenerator.shiftOperation(False,value.bit_length()-1)
+			return True
+		if operator == "%" and StrengthReducer.isPowerOfTwo(value):		# modulus 2^n is and 2^n-1
+			if value == 1:
+				self.codeGenerator.loadARegister([False,0])
+			else:
+				self.codeGenerator.binaryOperation("&",[False,value-1])
+			return True
+		return False
+	#
+	#		Multiply by constant.
+	#
+	def multiply(self,value):
+		if value == 0:													# x * 0 is 0
+			self.codeGenerator.loadARegister([False,0])
+			return True
+		bits = bin(value)[3:]											# bits after the most significant
+		if bits.count("1") > self.maxAdds:								# too many adds, use library
+			return False
+		if bits.count("1") > 0:											# keep x in temp for adding
+			self.codeGenerator.copyToTemp(True)
+		shift = 0
+		for bit in bits:												# work down, shift and add x
+			shift += 1
+			if bit == "1":
+				self.codeGenerator.shiftOperation(True,shift)
+				self.codeGenerator.addTemp()
+				shift = 0
+		if shift > 0:
+			self.codeGenerator.shiftOperation(True,shift)
+		return True
+	#
+	@staticmethod
+	def isPowerOfTwo(value):
+		return value > 0 and (value & (value-1)) == 0
+
+if __name__ == "__main__":
+	from democodegen import *
+	sr = StrengthReducer(DemoCodeGenerator())
+	for op,value in [["*",0],["*",1],["*",8],["*",10],["*",320],["*",255],["/",16],["/",10],["%",32],["%",7]]:
+		print("{0} {1}".format(op,value))
+		if not sr.reduce(op,value):
+			print("\t(library)")
@@ -0,0 +1,79 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		stringpool.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		23rd December 2018
+#		Purpose :	Shares ASCIIZ string constants
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+# ***************************************************************************************
+#
+#		Remembers where strings have been placed. A string which has been placed
+#		already, or is the end of one which has, is not placed again - "world" can
+#		be the last 6 bytes of "hello world" as both end with the same zero.
+#
+#		The pool does not place strings itself, whoever uses it does that and
+#		adds them. Placing the longest strings first shares the most.
+#
+# ***************************************************************************************
+
+class StringPool(object):
+	def __init__(self):
+		self.addresses = {} 											# string or end of one -> address
+		self.strings = [] 												# strings placed, in order
+		self.requested = 0 												# strings and bytes asked for
+		self.requestedBytes = 0
+		self.placedBytes = 0 											# bytes actually placed
+	#
+	#		Find where a string is, None if it has to be placed.
+	#
+	def find(self,string):
+		self.requested += 1
+		self.requestedBytes += len(string) + 1
+		return self.addresses.get(string)
+	#
+	#		Get the address of a string placed, or the end of one.
+	#
+	def getAddress(self,string):
+		return self.addresses[string]
+	#
+	#		Add a string which has been placed at an address.
+	#
+	def add(self,string,address):
+		self.strings.append(string)
+		self.placedBytes += len(string) + 1
+		for i in range(0,len(string)+1):
+			if string[i:] not in self.addresses:
+				self.addresses[string[i:]] = address + i
+	#
+	#		Strings placed, in the order they were.
+	#
+	def getStrings(self):
+		return self.strings
+	#
+	#		Strings and bytes asked for, as [strings,bytes]. The linker sets these
+	#		from the modules, as it only asks for each string once.
+	#
+	def getRequested(self):
+		return [self.requested,self.requestedBytes]
+	def setRequested(self,requested):
+		self.requested,self.requestedBytes = requested
+	#
+	def toString(self):
+		return "{0} strings, {1} placed, {2} of {3} bytes".format(self.requested,len(self.strings),self.placedBytes,self.requestedBytes)
+
+if __name__ == "__main__":
+	pool = StringPool()
+	address = 0x1000
+	for string in ["hello world","world","hello","","hello world","ld"]:
+		placed = pool.find(string)
+		if placed is None:
+			placed = address
+			pool.add(string,address)
+			address += len(string) + 1
+		print("'{0}' ${1:04x}".format(string,placed))
+	print(pool.getStrings())
+	print(pool.toString())
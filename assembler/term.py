@@ -28,63 +28,73 @@ class TermExtractor(object):
 	#		Extract a tern
 	#
 	def extract(self):
-		element = self.parser.get()
-		#print("["+element+"]")
+		token = self.parser.getToken()
+		kind = token.kind
 		#
 		#		Nothing
 		#
-		if element == "":
+		if kind == Token.EOF:
 			return None
 		#
-		#		- [Constant term]
-		#
-		if element == "-":
-			term = self.extract()
-			if term[0]:
-				print("Can only apply unary minus to constants")
-			term[1] = (-term[1]) & 0xFFFF
-			return term
-		#
 		#		Constant integer. Also hex and 'character', the parser handles this.
 		#
-		if element[0] >= '0' and element[0] <= '9':
-			return [False,int(element,10) & 0xFFFF]
+		if kind == Token.NUMBER:
+			return [False,token.value & 0xFFFF]
 		#
 		#		Identifier.
 		#
-		if (element[0] >= 'a' and element[0] <= 'z') or element[0] == "_":
-			dEntry = self.dictionary.find(element)
-			if dEntry is None:
-				raise AssemblerException("Unknown identifier "+element)
+		if kind == Token.IDENTIFIER:
+			dEntry = self.findIdentifier(token.text)
 			if isinstance(dEntry,ConstantIdentifier):
 				term = [False,dEntry.getValue()]
 			elif isinstance(dEntry,VariableIdentifier):
 				term = [True,dEntry.getValue()]
+			elif isinstance(dEntry,ArrayIdentifier):					# an array is its address
+				term = [False,dEntry.getValue()]
 			else:
-				raise AssemblerException("Cannot use "+element+" in expression.")
+				raise AssemblerException("Cannot use "+token.text+" in expression.")
+			return term
+		#
+		#		String
+		#
+		if kind == Token.STRING:
+			strAddr = self.codeGenerator.stringConstant(token.text[1:-1])
+			return [False,strAddr]
+		#
+		#		- [Constant term]
+		#
+		if token.text == "-":
+			term = self.extract()
+			if term[0] or term[1] > 0xFFFF:
+				raise AssemblerException("Can only apply unary minus to constants")
+			term[1] = (-term[1]) & 0xFFFF
 			return term
 		#
 		#		Identifier address.
 		#
-		if element[0] == '@':
+		if token.text == '@':
 			element = self.parser.get()
-			dEntry = self.dictionary.find(element)
-			if dEntry is None:
-				raise AssemblerException("Unknown identifier "+element)
-			if isinstance(dEntry,VariableIdentifier):
-				return [False, dEntry.getValue() & 0xFFFF]
+			dEntry = self.findIdentifier(element)
+			if isinstance(dEntry,VariableIdentifier) or isinstance(dEntry,ArrayIdentifier):
+				return [False, dEntry.getValue()]
 			raise AssemblerException("Cannot use @ operator on "+element)
 		#
-		#		String
-		#
-		if element[0] == '"':
-			strAddr = self.codeGenerator.stringConstant(element[1:-1])
-			return [False,strAddr]
-		#
 		#		Give up !
 		#
-		self.parser.put(element)
+		self.parser.put(token.text)
 		return None
+	#
+	#		Look up an identifier. When assembling a module to be linked, an unknown
+	#		global is a variable in another module, which the linker resolves.
+	#
+	def findIdentifier(self,name):
+		dEntry = self.dictionary.find(name)
+		if dEntry is None:
+			if name[0] == '_' or not self.codeGenerator.isRelocatable():
+				raise AssemblerException("Unknown identifier "+name)
+			dEntry = ExternalIdentifier(name,self.codeGenerator.getExternal(name),True)
+			self.dictionary.add(dEntry)
+		return dEntry
 
 if __name__ == "__main__":
 	tas = TextArrayStream("""
@@ -9,25 +9,34 @@
 # ***************************************************************************************
 # ***************************************************************************************
 
+import sys,itertools
 from errors import *
 from streams import *
+from tokeniser import *
 
 # ***************************************************************************************
 #									Element parser
 # ***************************************************************************************
 
 class TextParser(object):
-	def __init__(self,stream):
+	def __init__(self,stream,useTokeniser = True):
 		self.stream = stream
-		self.elementQueue = []
+		self.elementQueue = []											# put back stack, character scan
+		self.tokens = None 												# token generator if tokenising.
+		self.includes = [] 												# tokens being read by includers
+		self.read = [] 													# last few tokens read
+		self.pending = [] 												# tokens put back, a stack
+		self.endToken = None 											# EOF, once reached
+		if useTokeniser:
+			self.tokens = Tokeniser().tokenise(stream.getLines(),stream.getFileName())
 	#
 	#		Get the next element
 	#
 	def get(self):
+		if self.tokens is not None:										# tokenised, use the window
+			return self.getToken().text
 		if len(self.elementQueue) > 0:									# If something put back use that
-			element = self.elementQueue[0]
-			self.elementQueue = self.elementQueue[1:]
-			return element
+			return self.elementQueue.pop()
 		ch = self.stream.get().lower()									# Get first character
 		while ch == " ":												# Skip over spaces.
 			ch = self.get()
@@ -75,7 +84,7 @@ class TextParser(object):
 				ident = ident + ch
 				ch = self.stream.get().lower()
 			self.stream.put(ch)											# put back the unknown
-			return ident
+			return sys.intern(ident)
 		#
 		#		Quoted single character
 		#
@@ -94,12 +103,92 @@ class TextParser(object):
 				self.stream.put(ch)
 				ch = "-"
 		return ch	
-		
 	#
-	#		Put the next element back
+	#		Get the next element as a Token. Reading past the end keeps returning EOF.
+	#
+	def getToken(self):
+		if self.tokens is None: 										# character scan, classify it
+			return Token.classify(self.get(),self.stream.getFileName(),self.stream.getLineNumber())
+		if len(self.pending) > 0:
+			token = self.pending.pop()
+		elif self.endToken is not None:
+			token = self.endToken
+		else:
+			token = next(self.tokens,None)
+			while token is None and len(self.includes) > 0:				# end of an included file
+				self.tokens = self.includes.pop()
+				if self.tokens is None:									# back to scanning characters
+					return self.getToken()
+				token = next(self.tokens,None)
+			if token is None:											# end, EOF where the source ended
+				line = self.read[-1].line if len(self.read) > 0 else 0
+				self.endToken = Token(Token.EOF,"",None,self.stream.getFileName(),line,None)
+				token = self.endToken
+		self.read.append(token)
+		if len(self.read) > TextParser.WINDOW:							# only a few are kept
+			self.read.pop(0)
+		return token
+	#
+	#		Read the tokens of an included file until they run out, then carry on from
+	#		here. Included files are always tokenised, even when scanning characters.
+	#
+	def include(self,tokens):
+		if len(self.includes) >= TextParser.MAXINCLUDE:
+			raise AssemblerException("Includes nested too deeply")
+		if len(self.pending) > 0:										# looked ahead, those come after it
+			self.tokens = itertools.chain(reversed(self.pending),self.tokens)
+			self.pending = []
+		self.includes.append(self.tokens)
+		self.tokens = iter(tokens)
+	#
+	#		Get the location of the last element read, as [file,line,column]
+	#
+	def getLocation(self):
+		if self.tokens is None:
+			return [self.stream.getFileName(),self.stream.getLineNumber(),None]
+		if len(self.read) == 0:
+			return [self.stream.getFileName(),0,None]
+		token = self.read[-1]
+		return [token.fileName,token.line,token.column]
+	#
+	#		Put the next element back. When tokenised this must be the last one read
+	#		that has not already been put back.
 	#
 	def put(self,element):
-		self.elementQueue.insert(0,element)
+		if self.tokens is not None:
+			token = self.read.pop()
+			assert token.text == element,"put back "+element+" out of order"
+			self.pending.append(token)
+		else:
+			self.elementQueue.append(element)
+	#
+	#		Look at the next element without consuming it.
+	#
+	def peek(self):
+		element = self.get()
+		self.put(element)
+		return element
+	#
+	#		Look at the whole of the { } group coming next without consuming it. None
+	#		if the next element is not {, the group does not end in this file or the
+	#		source is not tokenised.
+	#
+	def peekGroup(self):
+		if self.tokens is None or self.endToken is not None:
+			return None
+		group = []
+		depth = 0
+		while len(group) == 0 or (depth > 0 and group[0].text == "{"):
+			token = self.pending.pop() if len(self.pending) > 0 else next(self.tokens,None)
+			if token is None:											# end of this file
+				break
+			group.append(token)
+			if token.text == "{" or token.text == "}":
+				depth += 1 if token.text == "{" else -1
+		self.pending += reversed(group) 								# all put back, in order
+		if len(group) == 0 or group[0].text != "{" or depth != 0:
+			return None
+		return [x.text for x in group]
 	#
 	#		Test the next element to see if it's what we want.
 	#
@@ -107,6 +196,9 @@ class TextParser(object):
 		if self.get() != element.lower():
 			raise AssemblerException("Missing "+element+" in source code.")
 
+TextParser.WINDOW = 8 													# tokens kept to be put back
+TextParser.MAXINCLUDE = 16 												# includes inside includes
+
 if __name__ == "__main__":
 	tas = TextArrayStream("""
 		$7FFE
@@ -123,3 +215,15 @@ if __name__ == "__main__":
 	while c != "":
 		print(c)
 		c = pars.get()
+
+	for source in ['{ include "file" a b } c','proc add(n) { include "file" n }']:
+		pars = TextParser(TextArrayStream([source]))					# include after looking ahead
+		elements = []
+		while pars.peek() != "{":
+			elements.append(pars.get())
+		print(pars.peekGroup())
+		elements += [pars.get(),pars.get(),pars.get()]
+		pars.include(Tokeniser().tokenise(["1 2"],"file"))
+		while elements[-1] != "":
+			elements.append(pars.get())
+		print(" ".join(elements))
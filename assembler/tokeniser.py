@@ -0,0 +1,174 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		tokeniser.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		20th December 2018
+#		Purpose :	Regular expression based line tokeniser
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+import re,os,sys
+from errors import *
+from streams import *
+
+# ***************************************************************************************
+#					A single token, its type, value and where it came from
+# ***************************************************************************************
+
+class Token(object):
+	__slots__ = [ "kind","text","value","fileName","line","column" ]
+	#
+	EOF = 0 															# token kinds.
+	NUMBER = 1
+	IDENTIFIER = 2
+	STRING = 3
+	PUNCTUATION = 4
+	#
+	def __init__(self,kind,text,value,fileName,line,column):
+		self.kind = kind 												# one of the above
+		self.text = text 												# text as TextParser.get() returns it
+		self.value = value 												# integer value for numbers
+		self.fileName = fileName 										# where it came from
+		self.line = line
+		self.column = column
+	#
+	#		Create a token from an element string (used by the character parser)
+	#
+	@staticmethod
+	def classify(text,fileName = None,line = 0,column = None):
+		if text == "":
+			return Token(Token.EOF,text,None,fileName,line,column)
+		if text[0] >= '0' and text[0] <= '9':
+			return Token(Token.NUMBER,text,int(text,10),fileName,line,column)
+		if (text[0] >= 'a' and text[0] <= 'z') or text[0] == '_':
+			return Token(Token.IDENTIFIER,text,None,fileName,line,column)
+		if text[0] == '"':
+			return Token(Token.STRING,text,None,fileName,line,column)
+		return Token(Token.PUNCTUATION,text,None,fileName,line,column)
+	#
+	def toString(self):
+		return "{0}:{1}:{2} {3} [{4}]".format(self.fileName,self.line,self.column,self.kind,self.text)
+
+# ***************************************************************************************
+#				Tokeniser. Scans whole lines rather than single characters
+# ***************************************************************************************
+
+class Tokeniser(object):
+	#
+	#		One master expression, the group matched decides the token type.
+	#
+	MATCHER = re.compile(r"""
+		\s+								|			# white space (no group, skipped)
+		(\"[^\"]*\")					|			# 1 : quoted string
+		\$([0-9a-fA-F]*)				|			# 2 : hexadecimal constant
+		([0-9]+)						|			# 3 : decimal constant
+		([a-zA-Z_][a-zA-Z0-9_.:]*)		|			# 4 : identifier
+		'(.)'							|			# 5 : quoted single character
+		(->)							|			# 6 : -> which is mapped onto >
+		(.)											# 7 : anything else, one character
+	""",re.VERBOSE)
+	#
+	#		Tokenise a list of lines, yields a Token for each one. The token text is the
+	#		same string TextParser.get() returns when scanning characters, so a string
+	#		can carry on over following lines, which are joined as they are.
+	#
+	def tokenise(self,lines,fileName = "<textarray>"):
+		lineNumber = 0
+		carried = None 													# [text,line,column] of an open string
+		for line in lines:
+			lineNumber += 1
+			start = 0
+			if carried is not None:										# still in a string
+				start = line.find('"')+1
+				carried[0] += line if start == 0 else line[:start]
+				if start == 0:
+					continue
+				yield Token(Token.STRING,carried[0],None,fileName,carried[1],carried[2])
+				carried = None
+			for m in Tokeniser.MATCHER.finditer(line,start):
+				group = m.lastindex
+				if group is None:										# white space
+					continue
+				column = m.start()+1
+				if group == 4:											# identifier
+					text = sys.intern(m.group(4).lower())				# so compared by reference
+					yield Token(Token.IDENTIFIER,text,None,fileName,lineNumber,column)
+				elif group == 3:										# decimal constant
+					text = m.group(3)
+					yield Token(Token.NUMBER,text,int(text,10),fileName,lineNumber,column)
+				elif group == 1:										# quoted string
+					yield Token(Token.STRING,m.group(1),None,fileName,lineNumber,column)
+				elif group == 2:										# hex, converted to decimal
+					if m.group(2) == "":
+						raise AssemblerException("Bad hexadecimal constant",fileName,lineNumber,column)
+					value = int(m.group(2),16) & 0xFFFF
+					yield Token(Token.NUMBER,str(value),value,fileName,lineNumber,column)
+				elif group == 5:										# character, converted to decimal
+					value = ord(m.group(5))
+					yield Token(Token.NUMBER,str(value),value,fileName,lineNumber,column)
+				elif group == 6:										# -> is the same as >
+					yield Token(Token.PUNCTUATION,">",None,fileName,lineNumber,column)
+				else:
+					text = m.group(7).lower()
+					if text == '"':										# string closed on a later line
+						carried = [line[m.start():],lineNumber,column]
+						break
+					if text == "'":
+						raise AssemblerException("Bad character constant",fileName,lineNumber,column)
+					yield Token(Token.PUNCTUATION,text,None,fileName,lineNumber,column)
+		if carried is not None:
+			raise AssemblerException("Missing closing quote for string",fileName,carried[1],carried[2])
+
+# ***************************************************************************************
+#
+#		Tokens of included files. Each file is tokenised once and the tokens kept,
+#		so every module including it reuses them. A file which has changed since
+#		it was tokenised, by its modification time or size, is tokenised again.
+#
+# ***************************************************************************************
+
+class TokenCache(object):
+	def __init__(self):
+		self.files = {} 												# full path -> [mtime,size,tokens]
+	#
+	#		Get the tokens of a file.
+	#
+	def getTokens(self,fileName):
+		key = os.path.abspath(fileName)
+		if not os.path.isfile(key):
+			raise AssemblerException("File not found",fileName,0)
+		info = os.stat(key)
+		entry = self.files.get(key)
+		if entry is None or entry[0] != info.st_mtime_ns or entry[1] != info.st_size:
+			tokens = list(Tokeniser().tokenise(FileStream(fileName).getLines(),fileName))
+			entry = [info.st_mtime_ns,info.st_size,tokens]
+			self.files[key] = entry
+		return entry[2]
+
+if __name__ == "__main__":
+	from textparser import *
+	src = """
+		$7FFE
+		locvar:test + 4 ;
+		"hello" 123 var.ident_1 >+< 'x' // comment
+		"world" $2A [42] a->b -4 x-> Mixed.Case
+		"a string over
+		three
+		lines" 7 "" '"'
+
+	""".split("\n")
+	#
+	#		Cross check the character parser against the tokeniser.
+	#
+	for useTokeniser in [False,True]:
+		pars = TextParser(TextArrayStream(src),useTokeniser)
+		result = []
+		c = pars.get()
+		while c != "":
+			result.append(c)
+			c = pars.get()
+		print(useTokeniser,result)
+	for t in Tokeniser().tokenise(TextArrayStream(src).getLines()):
+		print(t.toString())
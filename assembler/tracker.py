@@ -0,0 +1,129 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		tracker.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		23rd December 2018
+#		Purpose :	Tracks what A and the temp register hold
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+# ***************************************************************************************
+#
+#		Sits in front of the real code generator and keeps track of what A and the
+#		temp register hold, a constant and/or the variables they are the same as.
+#		A load of something A already holds, or a save of A to a variable it is
+#		already the same as, is not compiled.
+#
+#		Everything is forgotten where code can be jumped to, which is anywhere the
+#		current address is asked for, and by anything this does not know about,
+#		calls, loops and so on. Saves through A forget the variables, as they could
+#		be anywhere. Jumps out do not change A, so are let through.
+#
+# ***************************************************************************************
+
+class ValueTracker(object):
+	def __init__(self,codeGenerator):
+		self.codeGenerator = codeGenerator
+		self.forget()
+	#
+	#		Nothing known. Each register is [constant,set of variable addresses]
+	#
+	def forget(self):
+		self.a = [None,set()]
+		self.temp = [None,set()]
+	#
+	#		Load Accumulator with constant or term.
+	#
+	def loadARegister(self,term):
+		if term[0]:
+			if term[1] in self.a[1]:									# same as that variable
+				return
+			self.codeGenerator.loadARegister(term)
+			self.a = [None,set([term[1]])]
+		else:
+			if self.a[0] == term[1]:									# already that constant
+				return
+			self.codeGenerator.loadARegister(term)
+			self.a = [term[1],set()]
+	#
+	#		Perform a binary operation with a constant/term on the accumulator.
+	#
+	def binaryOperation(self,operator,term):
+		self.codeGenerator.binaryOperation(operator,term)
+		self.a = [None,set()]
+	#
+	#		Save A at the address given. If the address is not known yet, it could
+	#		be any variable.
+	#
+	def saveDirect(self,address):
+		if address is None:
+			self.a[1].clear()
+			self.temp[1].clear()
+			return self.codeGenerator.saveDirect(address)
+		if address in self.a[1]:										# already the same
+			return None
+		for register in [self.a,self.temp]:								# words overlapping it change
+			register[1].difference_update([address-1,address,address+1])
+		self.a[1].add(address)
+		return self.codeGenerator.saveDirect(address)
+	#
+	#		Save temp register indirect through A, which may change any variable.
+	#
+	def saveTempIndirect(self,isWord,restoreA = True):
+		self.codeGenerator.saveTempIndirect(isWord,restoreA)
+		self.a = [self.temp[0] if restoreA else None,set()]
+		self.temp = [None,set()]
+	#
+	#		Copy A to the temp register, A is unknown unless kept.
+	#
+	def copyToTemp(self,keepA = False):
+		self.codeGenerator.copyToTemp(keepA)
+		self.temp = [self.a[0],set(self.a[1])]
+		if not keepA:
+			self.a = [None,set()]
+	#
+	#		Operations changing A.
+	#
+	def addTemp(self):
+		self.codeGenerator.addTemp()
+		self.a = [None,set()]
+	def shiftOperation(self,isLeft,count):
+		self.codeGenerator.shiftOperation(isLeft,count)
+		self.a = [None,set()]
+	#
+	#		Jumps out leave A as it is.
+	#
+	def compileJump(self,condition):
+		return self.codeGenerator.compileJump(condition)
+	#
+	#		These do not compile code.
+	#
+	def isRelocatable(self):
+		return self.codeGenerator.isRelocatable()
+	def getExternal(self,name):
+		return self.codeGenerator.getExternal(name)
+	def allocate(self,count = 1):
+		return self.codeGenerator.allocate(count)
+	def stringConstant(self,str):
+		return self.codeGenerator.stringConstant(str)
+	#
+	#		Anything else forgets everything and goes to the code generator.
+	#
+	def __getattr__(self,name):
+		self.forget()
+		return getattr(self.codeGenerator,name)
+
+if __name__ == "__main__":
+	from textparser import *
+	from assembler import *
+	tas = TextArrayStream("""
+		global x global y global z
+		x+1>x>y x>z y
+		if (x#0) { x>y 1>z }
+		while (y<0) { y>x }
+		x>z 3 3>z
+	""".split("\n"))
+	asm = Assembler(Dictionary(),DemoCodeGenerator(True))
+	asm.assembleSource(TextParser(tas))
@@ -0,0 +1,435 @@
+# ***************************************************************************************
+# ***************************************************************************************
+#
+#		Name : 		z80codegen.py
+#		Author :	Paul Robson (paul@robsons.org.uk)
+#		Date : 		21st December 2018
+#		Purpose :	Z80N code generator, generating a boot.img file
+#
+# ***************************************************************************************
+# ***************************************************************************************
+
+from errors import *
+from codebuffer import *
+from imagewriter import *
+from stringpool import *
+
+# ***************************************************************************************
+#
+#		Code generator for the Z80N. HL is the accumulator (A), DE the temporary
+#		register (B) and BC holds the right hand operand of binary operations. The
+#		alternate BC counts for loops with nothing in them that could change it. A
+#		procedure calling nothing may keep its last parameter in DE.
+#
+#		Code is built at $8000 upwards, strings and variables in a data area at the
+#		top of the $8000-$BFFF block, strings from its bottom and variables, which
+#		are zero and so never written, from its top. This is written out in the
+#		layout bootloader.asm reads, $8000-$BFFF followed by 16k for each pair of 8k
+#		pages 32..95
+#
+#		$8000 is a jump to the boot code, which calls every <name>.boot procedure
+#		in the order defined, followed by the runtime library.
+#
+#		When relocatable, addresses are tagged with their segment in bits 16 up
+#		(CODE, DATA, BSS for variables, STRING for strings, or IMPORT+n for the n'th
+#		import) and offset from zero. Every tagged operand is recorded as a
+#		relocation, which the linker fixes. Strings are kept apart so the linker
+#		can share them between modules.
+#
+#		The same string is only placed once, see StringPool.
+#
+# ***************************************************************************************
+
+class Z80CodeGenerator(object):
+	def __init__(self,optimise = False,dataSize = 0x1000,relocatable = False):
+		self.optimise = optimise
+		self.relocatable = relocatable
+		self.fixups = {}												# unresolved, handle -> operand addr
+		self.relocations = [] 											# [operand offset,segment] for linker
+		self.imports = [] 												# names of imported globals
+		self.bssSize = 0 												# bytes of variables
+		self.tempVariable = None 										# variable kept in DE, if any
+		self.stringPool = StringPool()
+		self.jumpTypes = { "":[0xC3], "#":[0x7C,0xB5,0xC2], "=":[0x7C,0xB5,0xCA], \
+											"+":[0xCB,0x7C,0xCA], "-":[0xCB,0x7C,0xC2] }
+		self.logicalOps = { "&":0xA0,"|":0xB0,"^":0xA8 }				# and b, or b, xor b
+		if relocatable:													# runtime is linked in seperately
+			self.code = CodeBuffer(Z80CodeGenerator.CODE << 16)
+			self.data = CodeBuffer(Z80CodeGenerator.DATA << 16)
+			self.dataSize = Z80CodeGenerator.PAGESIZE
+			self.strings = CodeBuffer(Z80CodeGenerator.STRING << 16)
+			self.runtime = None											# imported when used
+		else:
+			self.code = CodeBuffer(0x8000)								# code space
+			self.data = CodeBuffer(0xC000-dataSize,dataSize)			# variables and strings
+			self.dataSize = dataSize
+			self.strings = self.data 									# strings are just data
+			self.code.append([0xC3,0x00,0x00])							# jp <boot code>
+			self.runtime = self.compileRuntime()
+	#
+	#		Compile the runtime library, returns routine addresses
+	#
+	def compileRuntime(self):
+		runtime = {}
+		runtime["*"] = self.code.getAddress() 							# multiply HL = HL * BC
+		self.code.append([	0xD5,0xEB,0x21,0x00,0x00,0x3E,0x10,				\
+							0x29,0xCB,0x11,0xCB,0x10,0x30,0x01,0x19,0x3D,0x20,0xF5,	\
+							0xD1,0xC9 ])
+		runtime["%"] = self.code.getAddress()							# divide HL / BC, remainder HL
+		self.code.append([	0xD5,0x50,0x59,0x7C,0x4D,0x21,0x00,0x00,0x06,0x10,	\
+							0xCB,0x21,0x17,0xED,0x6A,0x38,0x07,0xED,0x52,0x30,0x06,	\
+							0x19,0x18,0x04,0xB7,0xED,0x52,0x0C,0x10,0xEC,			\
+							0xD1,0xC9 ])
+		runtime["/"] = self.code.getAddress()							# divide HL / BC, quotient HL
+		self.emitWord([0xCD],runtime["%"])
+		self.code.append([0x67,0x69,0xC9])
+		return runtime
+	#
+	#		Compile the routine mapping the page pair in A at $C000-$FFFF, and the
+	#		variable holding the pair mapped, returns their addresses.
+	#
+	def compilePaging(self):
+		page = self.data.getAddress()
+		self.data.append([PagedImage.LASTPAGE,0])						# the loader leaves the last mapped
+		routine = self.getAddress()
+		self.emitWord([0x32],page)										# ld (page),a
+		self.code.append([0xED,0x92,0x56,0x3C,0xED,0x92,0x57,0xC9])		# nextreg $56,a inc a nextreg $57,a ret
+		return routine,page
+	#
+	#		Are addresses relocatable ?
+	#
+	def isRelocatable(self):
+		return self.relocatable
+	#
+	#		Get the tagged value standing for a global in another module.
+	#
+	def getExternal(self,name):
+		if name not in self.imports:
+			self.imports.append(name)
+		return (Z80CodeGenerator.IMPORT + self.imports.index(name)) << 16
+	#
+	#		Get current address in code space.
+	#
+	def getAddress(self):
+		return self.code.getAddress()
+	#
+	#		Allocate memory for words of variables. They are zero, so take no space
+	#		in the data, going down from its top, or in their own segment.
+	#
+	def allocate(self,count = 1):
+		if self.getDataSize() + count * 2 > self.dataSize:
+			raise AssemblerException("Out of variable memory")
+		self.bssSize += count * 2
+		if self.relocatable:
+			return (Z80CodeGenerator.BSS << 16) + self.bssSize - count * 2
+		return self.data.baseAddress + self.dataSize - self.bssSize
+	#
+	#		Place an ASCIIZ string constant, unless it is already there, and return
+	#		its address.
+	#
+	def stringConstant(self,str):
+		address = self.stringPool.find(str)
+		if address is None:
+			try:
+				data = str.encode("latin-1")+b"\x00"
+			except UnicodeEncodeError:
+				raise AssemblerException("Bad character in string")
+			if self.getDataSize() + len(data) > self.dataSize:
+				raise AssemblerException("Out of variable memory")
+			address = self.strings.getAddress()
+			self.strings.append(data)
+			self.stringPool.add(str,address)
+		return address
+	#
+	#		Bytes of data, strings and variables.
+	#
+	def getDataSize(self):
+		size = self.data.getSize() + self.bssSize
+		return size if self.strings is self.data else size + self.strings.getSize()
+	#
+	#		Load Accumulator with constant or term.
+	#
+	def loadARegister(self,term):
+		if term[0] and term[1] == self.tempVariable:
+			self.code.append([0x62,0x6B])								# ld h,d ld l,e
+			return
+		self.emitWord([0x2A] if term[0] else [0x21],term[1])			# ld hl,(nn) or ld hl,nn
+	#
+	#		Perform a binary operation with a constant/term on the accumulator.
+	#
+	def binaryOperation(self,operator,term):
+		if operator == "!" or operator == "?":							# indirect, we do add then read
+			if term[0] or term[1] != 0 or not self.optimise:			# no add needed for +0
+				self.binaryOperation("+",term)
+			if operator == "!":
+				self.code.append([0x7E,0x23,0x66,0x6F])					# ld a,(hl) inc hl ld h,(hl) ld l,a
+			else:
+				self.code.append([0x6E,0x26,0x00])						# ld l,(hl) ld h,0
+			return
+		if term[0] and term[1] == self.tempVariable:
+			self.code.append([0x42,0x4B])								# ld b,d ld c,e
+		else:
+			self.emitWord([0xED,0x4B] if term[0] else [0x01],term[1])	# ld bc,(nn) or ld bc,nn
+		if operator == "+":
+			self.code.append([0x09])									# add hl,bc
+		elif operator == "-":
+			self.code.append([0xA7,0xED,0x42])							# and a sbc hl,bc
+		elif operator in self.logicalOps:								# ld a,h op b ld h,a ld a,l op c ld l,a
+			opcode = self.logicalOps[operator]
+			self.code.append([0x7C,opcode,0x67,0x7D,opcode+1,0x6F])
+		else:
+			if self.runtime is None:									# * / % call the library
+				self.emitWord([0xCD],self.getExternal(Z80CodeGenerator.RUNTIME[operator]))
+			else:
+				self.emitWord([0xCD],self.runtime[operator])
+	#
+	#		Save A at the address given
+	#
+	def saveDirect(self,address):
+		if address is not None and address == self.tempVariable:
+			self.code.append([0x54,0x5D])								# ld d,h ld e,l
+			return None
+		return self.emitFixup([0x22],address)							# ld (nn),hl
+	#
+	#		Keep the variable at an address in the temp register rather than memory,
+	#		or stop if None. Nothing else may use the temp register while it does.
+	#
+	def setTempVariable(self,address):
+		self.tempVariable = address
+	#
+	#		Save temp register indirect through A, byte or word, and put temp back in A
+	#		unless it is not going to be used.
+	#
+	def saveTempIndirect(self,isWord,restoreA = True):
+		if isWord:
+			self.code.append([0x73,0x23,0x72])							# ld (hl),e inc hl ld (hl),d
+		else:
+			self.code.append([0x73])									# ld (hl),e
+		if restoreA:
+			self.code.append([0xEB])									# ex de,hl
+	#
+	#		Copy A to the temp register, A value unknown after this unless kept.
+	#
+	def copyToTemp(self,keepA = False):
+		if keepA:
+			self.code.append([0x54,0x5D])								# ld d,h ld e,l
+		else:
+			self.code.append([0xEB])									# ex de,hl
+	#
+	#		Add the temp register to A
+	#
+	def addTemp(self):
+		self.code.append([0x19])										# add hl,de
+	#
+	#		Logical shift A left or right
+	#
+	def shiftOperation(self,isLeft,count):
+		if count >= 8:													# shift a whole byte
+			self.code.append([0x65,0x2E,0x00] if isLeft else [0x6C,0x26,0x00])
+			count -= 8 													# ld h,l ld l,0 or ld l,h ld h,0
+		for i in range(0,count):
+			self.code.append([0x29] if isLeft else [0xCB,0x3C,0xCB,0x1D])	# add hl,hl or srl h rr l
+	#
+	#		Compile a call to a procedure (call should protect 'A')
+	#
+	def callProcedure(self,address):
+		return self.emitFixup([0xCD],address)							# call nn
+	#
+	#		Return from procedure (should protect A)
+	#
+	def returnProcedure(self):
+		self.code.append([0xC9])										# ret
+	#
+	#		Compile a jump with the given condition ( "", "=", "#", "+" "-""). The
+	#		target address is not known yet.
+	#
+	def compileJump(self,condition):
+		assert condition in self.jumpTypes
+		return self.emitFixup(self.jumpTypes[condition],None)
+	#
+	#		Patch a jump given its base addres
+	#
+	def patchJump(self,jumpAddr,target):
+		self.resolveFixup(jumpAddr,target)
+	#
+	#		Patch the address in a call or save compiled without one.
+	#
+	def patchAddress(self,instrAddr,address):
+		self.resolveFixup(instrAddr,address)
+	#
+	#		Compile the top of a for loop.
+	#
+	def forTopCode(self,indexVar):
+		loop = self.getAddress()
+		self.code.append([0x2B,0xE5])									# dec hl push hl
+		if indexVar is not None:										# if index exists put it there
+			self.saveDirect(indexVar.getValue())
+		return loop
+	#
+	#		Compile the bottom of a for loop
+	#
+	def forBottomCode(self,loopAddress):
+		self.code.append([0xE1])										# pop hl
+		self.emitWord(self.jumpTypes["#"],loopAddress)					# ld a,h or l jp nz,loop
+	#
+	#		Compile the top of a for loop counting in a register, for a body which has
+	#		no calls or loops. The count is in the alternate BC, which only this uses,
+	#		a constant count of 1-256 in B for djnz. count is the constant count, or
+	#		None if it is in A. A is only set to the index (and index saved) if setA,
+	#		a 16 bit count then stays on the stack, as getting it is slower than that.
+	#		Returns [loop address,True if counting in B, None on the stack].
+	#
+	def counterTopCode(self,indexVar,count,setA):
+		isByte = count is not None and count >= 1 and count <= 256
+		if setA and not isByte:
+			if count is not None:
+				self.loadARegister([False,count])
+			return [self.forTopCode(indexVar),None]
+		if count is None:
+			self.code.append([0xE5,0xD9,0xC1])							# push hl exx pop bc
+		elif isByte:
+			self.code.append([0xD9,0x06,count & 0xFF])					# exx ld b,n
+		else:
+			self.code.append([0xD9])									# exx ld bc,n
+			self.emitWord([0x01],count)
+		loop = self.getAddress()
+		if setA:
+			self.code.append([0x78,0x3D,0xD9,0x6F,0x26,0x00])			# ld a,b dec a exx ld l,a ld h,0
+			if indexVar is not None:
+				self.saveDirect(indexVar.getValue())
+		elif isByte:
+			self.code.append([0xD9])									# exx
+		else:
+			self.code.append([0x0B,0xD9])								# dec bc exx
+		return [loop,isByte]
+	#
+	#		Compile the bottom of a for loop counting in a register. djnz can only jump
+	#		back 128 bytes.
+	#
+	def counterBottomCode(self,loop):
+		if loop[1] is None:
+			self.forBottomCode(loop[0])
+			return
+		self.code.append([0xD9])										# exx
+		if not loop[1]:
+			self.emitWord([0x78,0xB1,0xC2],loop[0])						# ld a,b or c jp nz,loop
+		elif loop[0] - (self.getAddress() + 2) >= -128:
+			self.code.append([0x10,(loop[0] - self.getAddress() - 2) & 0xFF])	# djnz loop
+		else:
+			self.emitWord([0x05,0xC2],loop[0])							# dec b jp nz,loop
+		self.code.append([0xD9])										# exx
+	#
+	#		Emit opcode bytes followed by a 16 bit operand.
+	#
+	def emitWord(self,opcodes,operand):
+		self.relocate(self.getAddress()+len(opcodes),operand)
+		self.code.append(opcodes+[operand & 0xFF,(operand >> 8) & 0xFF])
+	#
+	#		Emit opcode bytes and operand, which may not be known yet (None). Returns
+	#		a handle (the instruction address) to patch it with.
+	#
+	def emitFixup(self,opcodes,operand):
+		instrAddr = self.getAddress()
+		if operand is None:
+			self.fixups[instrAddr] = instrAddr + len(opcodes)
+			operand = 0
+		self.emitWord(opcodes,operand)
+		return instrAddr
+	#
+	def resolveFixup(self,instrAddr,value):
+		operandAddr = self.fixups.pop(instrAddr)
+		self.relocate(operandAddr,value)
+		self.code.writeWord(operandAddr,value)
+	#
+	#		Record a tagged operand for the linker, which adds the segment base or
+	#		import address to the offset left in the code.
+	#
+	def relocate(self,operandAddr,value):
+		if value > 0xFFFF:
+			self.relocations.append([operandAddr & 0xFFFF,value >> 16])
+	#
+	#		Get the addresses of instructions still waiting for an operand
+	#
+	def getUnresolved(self):
+		return sorted(self.fixups.keys())
+	#
+	#		Get the code and data as bytes, and what the linker needs to place them.
+	#
+	def getCode(self):
+		return self.code.getBytes()
+	def getData(self):
+		return self.data.getBytes()
+	def getBSSSize(self):
+		return self.bssSize
+	def getStrings(self):
+		return self.stringPool.getStrings()
+	def getStringPool(self):
+		return self.stringPool
+	def getRelocations(self):
+		return self.relocations
+	def getImports(self):
+		return self.imports
+	#
+	#		Compile the boot code, which calls the boot procedures and then loops, and
+	#		make $8000 jump to it.
+	#
+	def complete(self,bootAddresses = []):
+		self.code.writeWord(0x8001,self.getAddress())
+		for address in bootAddresses:
+			self.emitWord([0xCD],address)								# call <name>.boot
+		self.code.append([0x18,0xFE])									# jr $
+	#
+	#		Write the code and data into a paged image, and close it.
+	#
+	def writeSegments(self,image):
+		if self.code.getAddress() > self.data.baseAddress:
+			raise AssemblerException("Out of code memory")
+		image.write(None,self.code.baseAddress,self.code.getBytes())
+		image.write(None,self.data.baseAddress,self.data.getBytes())
+		image.close()
+	#
+	#		Build the boot.img contents. $8000-$BFFF then the pages, which are empty.
+	#
+	def getImage(self):
+		image = PagedImage()
+		self.writeSegments(image)
+		return image.getBytes()
+	#
+	#		Write the boot.img file
+	#
+	def writeImage(self,fileName = "boot.img"):
+		image = PagedImage() 											# checked before the file is opened
+		self.writeSegments(image)
+		ImageWriter(fileName).copy(image)
+
+
+Z80CodeGenerator.PAGESIZE = PagedImage.PAGESIZE 						# bytes loaded per page pair
+
+Z80CodeGenerator.CODE = 1 												# relocatable segment tags
+Z80CodeGenerator.DATA = 2
+Z80CodeGenerator.BSS = 3
+Z80CodeGenerator.STRING = 4
+Z80CodeGenerator.IMPORT = 5
+Z80CodeGenerator.RUNTIME = { "*":"$multiply","/":"$divide","%":"$modulus" }
+Z80CodeGenerator.PAGING = [ "$setpage","$page" ] 						# page switch routine, variable
+
+if __name__ == "__main__":
+	from textparser import *
+	from assembler import *
+	tas = TextArrayStream("""
+		global count global result
+		proc multiply(a,b) { a*b }
+		proc demo.boot() {
+			multiply(6,7)>result
+			result / 5 > count
+			for (10) { count+1>count }
+			if (count-12 #0) { 1 > result }
+		}
+	""".split("\n"))
+	cg = Z80CodeGenerator()
+	asm = Assembler(Dictionary(),cg)
+	asm.assembleSource(TextParser(tas))
+	asm.complete()
+	cg.complete(asm.getBootAddresses())
+	print(" ".join(["{0:02x}".format(b) for b in cg.code.getBytes()]))
+	cg.writeImage("boot.img")